@@ -1,6 +1,10 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from typing import Dict, Any, Optional
 from datetime import datetime
+import asyncio
+import gzip
+import json
 import pymongo
 import os
 from models.user import User
@@ -13,6 +17,10 @@ MONGO_URI = os.getenv("MONGODB_URI")
 client = pymongo.MongoClient(MONGO_URI)
 db = client.pimer
 users = db.users
+# 桌面端同步的计数器：每个微信用户（openid）下按桌面端的本地用户名（profile）分别保存
+sync_profiles = db.sync_profiles
+# 每个同步文档保留最近多少个版本的写入设备，供长轮询判断是否为其他设备的写入
+REV_LOG_SIZE = 100
 
 @router.post("/work_records")
 async def sync_work_records(
@@ -54,4 +62,157 @@ async def get_work_records(
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    return {"work_records": user.work_records} 
\ No newline at end of file
+    return {"work_records": user.work_records} 
+
+async def _authorized_user(authorization: Optional[str]) -> User:
+    """校验Bearer令牌并返回用户"""
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Invalid authorization header")
+    
+    token = authorization.split(" ")[1]
+    user = await get_current_user(token)
+    
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return user
+
+def _etag(revision: int) -> str:
+    return f'"{revision}"'
+
+def _profile_filter(user: User, profile: str) -> Dict[str, Any]:
+    """桌面端本地用户的同步文档"""
+    if not profile:
+        raise HTTPException(status_code=400, detail="Missing profile")
+    return {"openid": user.openid, "profile": profile}
+
+@router.get("/cells")
+async def get_cells(
+    profile: str,
+    authorization: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    """获取一个本地用户每天各设备的计数器
+    
+    ETag为同步文档的版本号，版本未变化时返回304，不读取也不传输历史数据。
+    """
+    user = await _authorized_user(authorization)
+    query = _profile_filter(user, profile)
+    
+    meta = await run_in_threadpool(sync_profiles.find_one, query, {"sync_rev": 1})
+    etag = _etag(meta.get("sync_rev", 0) if meta else 0)
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    document = await run_in_threadpool(sync_profiles.find_one, query, {"work_days": 1, "sync_rev": 1}) or {}
+    cells = {
+        day: entry.get("devices", {})
+        for day, entry in document.get("work_days", {}).items()
+    }
+    # 读取期间可能有新的写入，使用与数据一起读出的版本号
+    etag = _etag(document.get("sync_rev", 0))
+    return Response(
+        content=json.dumps({"cells": cells}),
+        media_type="application/json",
+        headers={"ETag": etag}
+    )
+
+@router.post("/cells")
+async def push_cells(
+    request: Request,
+    profile: str,
+    authorization: Optional[str] = Header(None),
+    x_device_id: Optional[str] = Header(None)
+):
+    """上传一个本地用户的计数器增量（支持Content-Encoding: gzip）
+    
+    请求体为 {"cells": [[日期, 设备ID, 秒数], ...]}，以$max合并，可安全重放。
+    X-Device-Id按版本顺序记入rev_devices，长轮询据此忽略设备自己的上传。
+    响应的ETag为写入后的版本号，客户端可据此判断期间是否有其他设备写入。
+    """
+    user = await _authorized_user(authorization)
+    query = _profile_filter(user, profile)
+    
+    body = await request.body()
+    if request.headers.get("content-encoding") == "gzip":
+        try:
+            body = gzip.decompress(body)
+        except OSError:
+            raise HTTPException(status_code=400, detail="Invalid gzip body")
+    try:
+        cells = json.loads(body).get("cells", [])
+        update = {
+            f"work_days.{day}.devices.{device}": float(value)
+            for day, device, value in cells
+            if "." not in day and "." not in device and not device.startswith("$")
+        }
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cells payload")
+    
+    if not update:
+        return {"status": "success", "updated": 0}
+    
+    result = await run_in_threadpool(
+        sync_profiles.find_one_and_update,
+        query,
+        {
+            "$max": update,
+            "$inc": {"sync_rev": 1},
+            "$set": {"last_sync": datetime.utcnow(), "last_device": x_device_id},
+            "$push": {"rev_devices": {"$each": [x_device_id], "$slice": -REV_LOG_SIZE}}
+        },
+        projection={"sync_rev": 1},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    etag = _etag(result.get("sync_rev", 0) if result else 0)
+    return Response(
+        content=json.dumps({"status": "success", "updated": len(update)}),
+        media_type="application/json",
+        headers={"ETag": etag}
+    )
+
+# 长轮询检查版本号的间隔和最长挂起时间（秒）
+WATCH_CHECK_INTERVAL = 1
+WATCH_MAX_TIMEOUT = 55
+
+def _written_by_others(meta: Dict[str, Any], since: int, device: str) -> bool:
+    """版本(since, sync_rev]中是否有其他设备的写入
+
+    rev_devices依次记录最近REV_LOG_SIZE个版本的写入设备，
+    超出记录范围时无法确定，按有其他设备写入处理。
+    """
+    count = meta.get("sync_rev", 0) - since
+    log = meta.get("rev_devices", [])
+    if count > len(log):
+        return True
+    return any(writer != device for writer in log[len(log) - count:])
+
+@router.get("/cells/watch")
+async def watch_cells(
+    profile: str,
+    since: int = -1,
+    device: Optional[str] = None,
+    timeout: int = 25,
+    authorization: Optional[str] = Header(None)
+):
+    """长轮询等待其他设备上传
+    
+    每秒只读取一次同步版本号；版本超过since时返回 {"changed", "revision"}，
+    若新版本全部由请求方自己（device）写入则更新since继续等待；超时返回204。
+    """
+    user = await _authorized_user(authorization)
+    query = _profile_filter(user, profile)
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max(1, min(timeout, WATCH_MAX_TIMEOUT))
+    while True:
+        # pymongo是阻塞的，放到线程池中执行，不占用事件循环
+        meta = await run_in_threadpool(sync_profiles.find_one, query, {"sync_rev": 1, "rev_devices": 1}) or {}
+        revision = meta.get("sync_rev", 0)
+        if revision > since:
+            if not device or _written_by_others(meta, since, device):
+                return {"changed": True, "revision": revision}
+            since = revision
+        if loop.time() >= deadline:
+            return Response(status_code=204)
+        await asyncio.sleep(WATCH_CHECK_INTERVAL)
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from api.wechat import router as wechat_router
 from api.auth import router as auth_router
 from api.sync import router as sync_router
@@ -20,6 +21,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 压缩较大的响应（同步下载的历史数据）
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
 # 注册路由
 app.include_router(wechat_router, prefix="/api/wechat", tags=["wechat"])
 app.include_router(auth_router, prefix="/api/auth", tags=["auth"])
@@ -0,0 +1,154 @@
+"""桌面端HttpTransport与后端同步接口的集成测试（在本地uvicorn实例上运行）
+
+依赖见backend/requirements-test.txt，数据库使用mongomock。
+"""
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(BACKEND_DIR.parent))
+
+mongomock = pytest.importorskip("mongomock")
+uvicorn = pytest.importorskip("uvicorn")
+from fastapi import FastAPI
+
+from api import sync
+from models.user import User
+from cloud_connection import HttpConnection
+from sync_transport import HttpTransport
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    async def current_user(token):
+        return User(openid=token)
+
+    patch = pytest.MonkeyPatch()
+    patch.setattr(sync, "sync_profiles", mongomock.MongoClient().pimer.sync_profiles)
+    patch.setattr(sync, "get_current_user", current_user)
+    patch.setattr(sync, "WATCH_CHECK_INTERVAL", 0.05)
+
+    app = FastAPI()
+    app.include_router(sync.router, prefix="/api/sync")
+
+    @app.get("/")
+    async def root():
+        return {"message": "ok"}
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        assert time.monotonic() < deadline, "uvicorn未能启动"
+        time.sleep(0.05)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join(5)
+    patch.undo()
+
+
+def make_transport(base_url, token, username, device_id):
+    connection = HttpConnection(base_url, token)
+    assert connection.connect()
+    return HttpTransport(connection, username, device_id)
+
+
+def test_push_gzip_and_conditional_pull(base_url):
+    transport = make_transport(base_url, "openid-1", "alice", "A")
+    assert transport.pull_cells() == {}
+    etag = transport.etag
+
+    transport.push_cells([(("2026-10-19", "A"), 100)])
+    # 期间没有其他设备写入，沿用上传返回的ETag，下载得到304
+    assert transport.etag == f'"{HttpTransport.revision(etag) + 1}"'
+    assert transport.pull_cells() == {}
+
+    other = make_transport(base_url, "openid-1", "alice", "B")
+    assert other.pull_cells() == {"2026-10-19": {"A": 100.0}}
+
+    # $max合并：较小的值不会覆盖
+    transport.push_cells([(("2026-10-19", "A"), 40)])
+    assert other.pull_cells() == {"2026-10-19": {"A": 100.0}}
+
+
+def test_other_device_write_invalidates_etag(base_url):
+    first = make_transport(base_url, "openid-2", "bob", "A")
+    second = make_transport(base_url, "openid-2", "bob", "B")
+    first.pull_cells()
+    second.pull_cells()
+
+    second.push_cells([(("2026-10-19", "B"), 50)])
+    first.push_cells([(("2026-10-19", "A"), 30)])
+    # 上传前云端已有其他设备的写入，必须重新下载
+    assert first.pull_cells() == {"2026-10-19": {"A": 30.0, "B": 50.0}}
+    assert first.pull_cells() == {}
+
+
+def test_profiles_are_separate(base_url):
+    alice = make_transport(base_url, "openid-3", "alice", "A")
+    bob = make_transport(base_url, "openid-3", "bob", "A")
+    alice.push_cells([(("2026-10-19", "A"), 10)])
+    bob.push_cells([(("2026-10-19", "A"), 20)])
+
+    assert make_transport(base_url, "openid-3", "alice", "B").pull_cells() == {"2026-10-19": {"A": 10.0}}
+    assert make_transport(base_url, "openid-3", "bob", "B").pull_cells() == {"2026-10-19": {"A": 20.0}}
+    assert make_transport(base_url, "openid-4", "alice", "B").pull_cells() == {}
+
+
+def test_watch_reports_other_devices_only(base_url, monkeypatch):
+    monkeypatch.setattr(HttpTransport, "WATCH_TIMEOUT", 1)
+    watcher = make_transport(base_url, "openid-5", "carol", "A")
+    watcher.push_cells([(("2026-10-19", "A"), 1)])
+    watcher.pull_cells()
+
+    changes = threading.Event()
+    stop = threading.Event()
+
+    def on_change():
+        changes.set()
+        stop.set()
+
+    thread = threading.Thread(target=watcher.watch, args=(on_change, stop), daemon=True)
+    thread.start()
+
+    watcher.push_cells([(("2026-10-19", "A"), 2)])
+    assert not changes.wait(0.5)
+
+    make_transport(base_url, "openid-5", "carol", "B").push_cells([(("2026-10-19", "B"), 5)])
+    assert changes.wait(5)
+    thread.join(5)
+
+
+def test_watch_reports_other_device_before_own_write(base_url):
+    watcher = make_transport(base_url, "openid-6", "dave", "A")
+    watcher.push_cells([(("2026-10-19", "A"), 1)])
+    watcher.pull_cells()
+    since = HttpTransport.revision(watcher.etag)
+
+    # 其他设备写入版本N，随后本设备写入版本N+1，最后写入者是自己也要报告
+    make_transport(base_url, "openid-6", "dave", "B").push_cells([(("2026-10-19", "B"), 5)])
+    watcher.push_cells([(("2026-10-19", "A"), 2)])
+
+    client = watcher.connection.get_client()
+    response = client.get(f"{base_url}/api/sync/cells/watch",
+                          params={"profile": "dave", "since": since, "device": "A", "timeout": 1})
+    assert response.status_code == 200
+    assert response.json() == {"changed": True, "revision": since + 2}
+
+    response = client.get(f"{base_url}/api/sync/cells/watch",
+                          params={"profile": "dave", "since": since + 1, "device": "A", "timeout": 1})
+    assert response.status_code == 204
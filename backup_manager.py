@@ -0,0 +1,287 @@
+import json
+import os
+import threading
+from bisect import bisect_right, insort
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+# 备份设置保存在settings.json中（与WorkTimer的Settings共用），命令行工具按同样的设置剪枝
+SETTINGS_FILE = 'settings.json'
+DEFAULT_QUOTA_MB = 50
+
+
+class RetentionPolicy:
+    """祖父-父-子（GFS）备份保留策略
+
+    每一层保留若干个时间桶，每个桶只保留其中最新的一个快照：
+    - last: 最近N个快照（不论时间）
+    - daily: 最近N天，每天一个
+    - weekly: 最近N周，每周一个
+    - monthly: 最近N个月，每月一个
+    - yearly: 最近N年，每年一个
+    一个快照只要仍被任意一层引用就会被保留。
+    """
+
+    TIERS = ('last', 'daily', 'weekly', 'monthly', 'yearly')
+    DEFAULTS = {
+        'last': 10,
+        'daily': 14,
+        'weekly': 8,
+        'monthly': 12,
+        'yearly': 5
+    }
+
+    def __init__(self, **counts):
+        self.counts = dict(self.DEFAULTS)
+        for tier, count in counts.items():
+            if tier not in self.TIERS:
+                raise ValueError(f"未知的保留层级: {tier}")
+            self.counts[tier] = max(0, int(count))
+
+    @classmethod
+    def from_config(cls, config):
+        """从设置字典创建策略，缺省的层级使用默认值"""
+        return cls(**(config or {}))
+
+    @staticmethod
+    def bucket_key(tier, moment, name):
+        """返回快照在指定层级中所属的桶"""
+        if tier == 'last':
+            return name
+        if tier == 'daily':
+            return moment.strftime('%Y-%m-%d')
+        if tier == 'weekly':
+            year, week, _ = moment.isocalendar()
+            return f"{year}-W{week:02d}"
+        if tier == 'monthly':
+            return moment.strftime('%Y-%m')
+        return moment.strftime('%Y')
+
+
+class BackupManager:
+    """基于索引的备份快照管理器
+
+    索引文件记录按时间排序的快照列表以及每个保留层级当前占用的桶。
+    新快照总是最新的，因此只需替换各层最后一个桶或追加新桶、
+    弹出最旧的桶，剪枝不需要列出和排序整个备份目录。
+    """
+
+    INDEX_FILE = 'index.json'
+    TIMESTAMP_FORMAT = '%Y%m%d_%H%M%S'
+
+    def __init__(self, backup_dir, policy=None, quota_bytes=None):
+        """初始化备份管理器
+
+        Args:
+            backup_dir: 备份目录（每个用户一个独立目录）
+            policy: 保留策略，默认使用RetentionPolicy的默认值
+            quota_bytes: 该目录下快照占用的字节上限，None表示不限制
+        """
+        self.backup_dir = Path(backup_dir)
+        self.index_file = self.backup_dir / self.INDEX_FILE
+        self.policy = policy or RetentionPolicy()
+        self.quota_bytes = quota_bytes
+        self.lock = threading.Lock()
+        self.load_index()
+
+    @classmethod
+    def from_settings(cls, backup_dir, settings_file=SETTINGS_FILE):
+        """按设置文件中用户的保留策略（backup_retention）和配额（backup_quota_mb）创建
+
+        主程序之外的工具（导入、恢复）创建快照时也使用用户的设置，
+        不会按默认策略剪掉用户设置保留的快照。
+        """
+        try:
+            with open(settings_file, 'r') as f:
+                settings = json.load(f)
+        except FileNotFoundError:
+            settings = {}
+        except Exception as e:
+            print(f"读取备份设置失败: {e}")
+            settings = {}
+        policy = RetentionPolicy.from_config(settings.get('backup_retention'))
+        quota_mb = settings.get('backup_quota_mb', DEFAULT_QUOTA_MB)
+        quota_bytes = quota_mb * 1024 * 1024 if quota_mb is not None else None
+        return cls(backup_dir, policy, quota_bytes)
+
+    def load_index(self):
+        """加载索引，索引不存在时从目录中的旧备份一次性重建"""
+        self.snapshots = []  # [(时间戳ISO字符串, 文件名)]，按时间排序
+        self.tiers = {tier: [] for tier in RetentionPolicy.TIERS}  # 层级 -> [[桶, 文件名]]
+        self.sizes = {}  # 文件名 -> 字节数
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            self.snapshots = [tuple(item) for item in index.get('snapshots', [])]
+            for tier in RetentionPolicy.TIERS:
+                self.tiers[tier] = [list(item) for item in index.get('tiers', {}).get(tier, [])]
+            self.sizes = index.get('sizes', {})
+        except FileNotFoundError:
+            self.rebuild_index()
+        except Exception as e:
+            print(f"加载备份索引失败: {e}，重新建立索引")
+            self.rebuild_index()
+        self.refs = Counter(name for entries in self.tiers.values() for _, name in entries)
+        self.total_bytes = sum(self.sizes.values())
+
+    def rebuild_index(self):
+        """扫描备份目录重建索引（仅在索引缺失或损坏时执行）"""
+        self.snapshots = []
+        self.tiers = {tier: [] for tier in RetentionPolicy.TIERS}
+        self.refs = Counter()
+        self.sizes = {}
+        self.total_bytes = 0
+        if not self.backup_dir.exists():
+            return
+        found = []
+        for path in self.backup_dir.glob('work_time_*.json'):
+            moment = self.parse_timestamp(path.name)
+            if moment:
+                found.append((moment, path.name))
+        for moment, name in sorted(found):
+            self.snapshots.append((moment.isoformat(), name))
+            self._track_size(name)
+            for stale in self._retain(name, moment):
+                self._remove_snapshot(stale)
+        self._enforce_quota()
+        self.save_index()
+
+    def save_index(self):
+        """原子地写入索引文件"""
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        index = {
+            'version': 1,
+            'snapshots': self.snapshots,
+            'tiers': self.tiers,
+            'sizes': self.sizes
+        }
+        tmp_file = self.index_file.with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_file, self.index_file)
+
+    @classmethod
+    def parse_timestamp(cls, name):
+        """从备份文件名中解析时间戳，无法解析时返回None"""
+        stem = Path(name).stem[len('work_time_'):]
+        try:
+            return datetime.strptime(stem[:15], cls.TIMESTAMP_FORMAT)
+        except ValueError:
+            return None
+
+    def create_snapshot(self, source_file, now=None):
+        """为数据文件创建一个快照，并按保留策略剪枝
+
+        Args:
+            source_file: 要备份的数据文件
+            now: 快照时间，默认当前时间
+
+        Returns:
+            Path: 新快照的路径；数据文件不存在时返回None
+        """
+        source_file = Path(source_file)
+        if not source_file.exists():
+            return None
+
+        moment = (now or datetime.now()).replace(microsecond=0)
+        with self.lock:
+            self.backup_dir.mkdir(parents=True, exist_ok=True)
+
+            # 同一秒内的多次备份使用递增后缀，避免覆盖
+            name = f"work_time_{moment.strftime(self.TIMESTAMP_FORMAT)}.json"
+            suffix = 1
+            while (self.backup_dir / name).exists():
+                name = f"work_time_{moment.strftime(self.TIMESTAMP_FORMAT)}_{suffix}.json"
+                suffix += 1
+
+            with open(source_file, 'r') as src:
+                data = json.load(src)
+            with open(self.backup_dir / name, 'w') as dst:
+                json.dump(data, dst, indent=4)
+
+            insort(self.snapshots, (moment.isoformat(), name))
+            self._track_size(name)
+            for stale in self._retain(name, moment):
+                self._remove_snapshot(stale)
+            self._enforce_quota()
+            self.save_index()
+            return self.backup_dir / name
+
+    def _retain(self, name, moment):
+        """将新快照登记到各保留层级，返回不再被任何层级引用的快照"""
+        released = []
+        for tier in RetentionPolicy.TIERS:
+            keep = self.policy.counts[tier]
+            entries = self.tiers[tier]
+            if keep <= 0:
+                continue
+            key = RetentionPolicy.bucket_key(tier, moment, name)
+            if entries and entries[-1][0] == key:
+                # 同一个桶内，新快照替换旧快照
+                released.append(entries[-1][1])
+                entries[-1] = [key, name]
+            else:
+                entries.append([key, name])
+            self.refs[name] += 1
+            while len(entries) > keep:
+                _, old_name = entries.pop(0)
+                released.append(old_name)
+
+        stale = []
+        for old_name in released:
+            self.refs[old_name] -= 1
+            if self.refs[old_name] <= 0:
+                del self.refs[old_name]
+                stale.append(old_name)
+        return stale
+
+    def _track_size(self, name):
+        """记录快照文件大小，用于配额统计"""
+        try:
+            size = (self.backup_dir / name).stat().st_size
+        except OSError:
+            size = 0
+        self.sizes[name] = size
+        self.total_bytes += size
+
+    def _enforce_quota(self):
+        """超出配额时从最旧的快照开始淘汰，始终保留最新的快照"""
+        if self.quota_bytes is None:
+            return
+        while self.total_bytes > self.quota_bytes and len(self.snapshots) > 1:
+            _, name = self.snapshots[0]
+            # 最旧的快照只可能位于各层级的队首
+            for entries in self.tiers.values():
+                if entries and entries[0][1] == name:
+                    entries.pop(0)
+            self.refs.pop(name, None)
+            self._remove_snapshot(name)
+
+    def _remove_snapshot(self, name):
+        """删除快照文件并从快照列表中移除"""
+        self.total_bytes -= self.sizes.pop(name, 0)
+        moment = self.parse_timestamp(name)
+        if moment:
+            position = bisect_right(self.snapshots, (moment.isoformat(), name)) - 1
+            if position >= 0 and self.snapshots[position][1] == name:
+                del self.snapshots[position]
+        else:
+            self.snapshots = [item for item in self.snapshots if item[1] != name]
+        try:
+            (self.backup_dir / name).unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"删除旧备份失败: {name}: {e}")
+
+    def list_snapshots(self):
+        """返回所有保留的快照 [(datetime, Path)]，按时间排序"""
+        return [(datetime.fromisoformat(ts), self.backup_dir / name) for ts, name in self.snapshots]
+
+    def find_snapshot(self, moment):
+        """二分查找不晚于指定时间的最新快照，没有时返回None"""
+        position = bisect_right(self.snapshots, (moment.isoformat(), '\uffff')) - 1
+        if position < 0:
+            return None
+        return self.backup_dir / self.snapshots[position][1]
@@ -0,0 +1,278 @@
+import os
+import random
+import threading
+
+# 尝试导入可选依赖
+try:
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    MONGODB_AVAILABLE = True
+except ImportError:
+    MONGODB_AVAILABLE = False
+
+try:
+    import requests
+    import requests.adapters
+    REQUESTS_AVAILABLE = True
+except ImportError:
+    REQUESTS_AVAILABLE = False
+
+
+class ConnectionState:
+    """连接状态"""
+    UNAVAILABLE = 'unavailable'    # 未安装依赖或未配置URI
+    DISCONNECTED = 'disconnected'  # 尚未连接
+    CONNECTING = 'connecting'      # 正在连接
+    CONNECTED = 'connected'        # 已连接
+    BACKOFF = 'backoff'            # 连接失败，等待下一次重连
+
+
+class ConnectionManager:
+    """共享的MongoDB连接管理器
+
+    CloudSync和UserManager共用同一个惰性创建的MongoClient（有界连接池、显式超时）。
+    连接失败后按带抖动的指数退避自动重连，状态变化时通知所有监听器，
+    UI无需轮询即可更新状态栏。
+    """
+
+    MAX_POOL_SIZE = 10
+    SERVER_SELECTION_TIMEOUT_MS = 5000
+    CONNECT_TIMEOUT_MS = 5000
+    SOCKET_TIMEOUT_MS = 15000
+
+    BACKOFF_BASE = 2    # 第一次重连等待的秒数
+    BACKOFF_MAX = 300   # 重连等待的上限（秒）
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.listeners = []
+        self.client = None
+        self.attempt = 0
+        self.retry_timer = None
+        self.closed = False
+        self.state = self.configure()
+
+    def configure(self):
+        """读取连接配置，返回初始状态（子类覆盖以使用其他后端）"""
+        self.uri = None
+        self.db_name = 'work_timer'
+        if not MONGODB_AVAILABLE:
+            print("未安装MongoDB依赖，使用本地模式")
+            return ConnectionState.UNAVAILABLE
+
+        # 加载环境变量
+        load_dotenv()
+        self.uri = os.getenv('MONGODB_URI')
+        self.db_name = os.getenv('MONGODB_DB', 'work_timer')
+        if not self.uri:
+            print("未设置MongoDB URI，使用本地模式")
+            return ConnectionState.UNAVAILABLE
+        return ConnectionState.DISCONNECTED
+
+    @property
+    def available(self):
+        """是否具备连接云端的条件"""
+        return self.state != ConnectionState.UNAVAILABLE
+
+    @property
+    def is_connected(self):
+        return self.state == ConnectionState.CONNECTED
+
+    def add_listener(self, callback):
+        """注册状态变化监听器，callback(state)可能在任意线程中被调用"""
+        with self.lock:
+            if callback not in self.listeners:
+                self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """移除状态变化监听器"""
+        with self.lock:
+            if callback in self.listeners:
+                self.listeners.remove(callback)
+
+    def _set_state(self, state):
+        """切换状态，状态确有变化时通知监听器"""
+        with self.lock:
+            if self.state == state:
+                return
+            self.state = state
+            listeners = list(self.listeners)
+        for callback in listeners:
+            try:
+                callback(state)
+            except Exception as e:
+                print(f"连接状态监听器出错: {e}")
+
+    def get_client(self):
+        """惰性创建共享的MongoClient（创建本身不访问网络）"""
+        with self.lock:
+            if self.client is None and self.available:
+                self.client = MongoClient(
+                    self.uri,
+                    maxPoolSize=self.MAX_POOL_SIZE,
+                    serverSelectionTimeoutMS=self.SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=self.CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=self.SOCKET_TIMEOUT_MS
+                )
+            return self.client
+
+    def get_collection(self, name):
+        """获取集合对象，不可用时返回None"""
+        client = self.get_client()
+        if client is None:
+            return None
+        return client[self.db_name][name]
+
+    def probe(self):
+        """测试一次连接，失败时抛出异常"""
+        self.get_client().admin.command('ping')
+
+    def connect(self):
+        """立即测试连接（会阻塞至多SERVER_SELECTION_TIMEOUT_MS），返回是否已连接"""
+        if not self.available or self.closed:
+            return False
+        self._set_state(ConnectionState.CONNECTING)
+        try:
+            self.probe()
+        except Exception as e:
+            self.report_failure(e)
+            return False
+        self.report_success()
+        return True
+
+    def ensure_connected(self):
+        """已连接时直接返回；正在退避时不额外重试；否则尝试连接"""
+        if self.state == ConnectionState.CONNECTED:
+            return True
+        if self.state in (ConnectionState.BACKOFF, ConnectionState.CONNECTING, ConnectionState.UNAVAILABLE):
+            return False
+        return self.connect()
+
+    def report_success(self):
+        """一次云端操作成功"""
+        with self.lock:
+            self.attempt = 0
+            if self.retry_timer:
+                self.retry_timer.cancel()
+                self.retry_timer = None
+        if self.available:
+            self._set_state(ConnectionState.CONNECTED)
+
+    def report_failure(self, error=None):
+        """一次云端操作失败，进入退避状态并安排重连"""
+        if not self.available or self.closed:
+            return
+        with self.lock:
+            if self.retry_timer:
+                # 已经安排了重连，不重复计数
+                return
+            delay = self.next_backoff()
+            self.attempt += 1
+            self.retry_timer = threading.Timer(delay, self._retry)
+            self.retry_timer.daemon = True
+            self.retry_timer.start()
+        if error is not None:
+            print(f"云端连接失败: {error}，{delay:.1f}秒后重试")
+        self._set_state(ConnectionState.BACKOFF)
+
+    def next_backoff(self):
+        """下一次重连前的等待时间：指数增长，上限BACKOFF_MAX，并加入±50%抖动"""
+        delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * (2 ** self.attempt))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _retry(self):
+        """重连定时器回调"""
+        with self.lock:
+            self.retry_timer = None
+        self.connect()
+
+    def close(self):
+        """关闭共享连接（仅在程序退出时调用）"""
+        with self.lock:
+            self.closed = True
+            if self.retry_timer:
+                self.retry_timer.cancel()
+                self.retry_timer = None
+            client = self.client
+            self.client = None
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+        if self.available:
+            self._set_state(ConnectionState.DISCONNECTED)
+
+
+class HttpConnection(ConnectionManager):
+    """后端REST API的连接管理器
+
+    使用带连接池的requests.Session，重连和状态通知沿用ConnectionManager的退避状态机。
+    """
+
+    POOL_SIZE = 4
+    TIMEOUT = (5, 15)  # (连接超时, 读取超时)，单位秒
+
+    def __init__(self, base_url, token):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        super().__init__()
+
+    def configure(self):
+        """检查HTTP依赖，返回初始状态"""
+        if not REQUESTS_AVAILABLE:
+            print("未安装requests依赖，无法使用后端同步")
+            return ConnectionState.UNAVAILABLE
+        return ConnectionState.DISCONNECTED
+
+    def get_client(self):
+        """惰性创建共享的HTTP会话"""
+        with self.lock:
+            if self.client is None and self.available:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['Authorization'] = f"Bearer {self.token}"
+                self.client = session
+            return self.client
+
+    def get_collection(self, name):
+        return None
+
+    def probe(self):
+        """访问后端根路径测试连接"""
+        response = self.get_client().get(f"{self.base_url}/", timeout=self.TIMEOUT)
+        response.raise_for_status()
+
+    def url(self, path):
+        """拼接后端接口地址"""
+        return f"{self.base_url}{path}"
+
+
+_manager = None
+_manager_lock = threading.Lock()
+_http_connection = None
+
+
+def get_connection_manager():
+    """获取进程内共享的连接管理器"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ConnectionManager()
+        return _manager
+
+
+def get_http_connection():
+    """获取进程内共享的后端连接；未配置PIMER_API_URL时返回None"""
+    global _http_connection
+    with _manager_lock:
+        if _http_connection is None:
+            if MONGODB_AVAILABLE:
+                load_dotenv()
+            base_url = os.getenv('PIMER_API_URL')
+            if not base_url:
+                return None
+            _http_connection = HttpConnection(base_url, os.getenv('PIMER_API_TOKEN', ''))
+        return _http_connection
@@ -1,72 +1,277 @@
 import os
 import json
-from datetime import datetime
 from pathlib import Path
-import threading
 import time
+from datetime import datetime
+
+from cloud_connection import get_connection_manager, get_http_connection
+from history_hash import HistoryHashTree
+from history_pack import is_packable
+from sync_transport import META_FIELDS, LEGACY_DEVICE, MongoTransport, HttpTransport, day_total
+
+# 每次写入云端的最大字段数，离线积压较多时分批回放
+UPLOAD_BATCH_SIZE = 500
+
 
-# 尝试导入可选依赖
-try:
-    from dotenv import load_dotenv
-    from pymongo import MongoClient
-    import pymongo.errors
-    MONGODB_AVAILABLE = True
-except ImportError:
-    MONGODB_AVAILABLE = False
+def record_restore(user_dir, data):
+    """pimer restore写入恢复结果后调用：把恢复后的总时长与计数器之和的差值记为本地偏移
+
+    恢复只在本机生效，之后的同步不会用云端的计数器把恢复的日期改回去。
+    需在程序未运行时调用，否则会被运行中的同步状态覆盖。
+    """
+    path = Path(user_dir) / 'sync_state.json'
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return
+    counters = state.get('counters')
+    if not counters:
+        return  # 尚未按设备计数，第一次同步时以本地数据为准
+    days = {key: value for key, value in data.items() if key not in META_FIELDS}
+    offsets = state.setdefault('offsets', {})
+    for day, cells in counters.items():
+        offset = day_total(days.get(day)) - sum(cells.values())
+        if offset:
+            offsets[day] = offset
+        else:
+            offsets.pop(day, None)
+    tmp_file = path.with_suffix('.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_file, path)
 
 class CloudSync:
-    def __init__(self, username):
-        """初始化云同步管理器"""
+    """云同步管理器
+
+    每一天的工作时长按设备分别计数（days.<日期>.devices.<设备ID>），
+    各设备只增加自己的计数器，合并时逐个计数器取最大值，
+    即一个只增不减的计数器CRDT，多台设备同一天工作不会互相覆盖。
+    本地和云端都保存计数器的哈希树，同步时根哈希相同就不再下载。
+
+    本地每天的总时长 = 各设备计数之和 + 本地偏移。偏移只由pimer restore写入，
+    恢复只改变本机看到的总时长，不回退云端和其他设备的计数器。
+    """
+    
+    def __init__(self, username, device_id, history_log=None):
+        """初始化云同步管理器
+        
+        Args:
+            username: 用户名
+            device_id: 本设备ID（CloudConfig.setup_device_id生成）
+            history_log: 该用户的HistoryLog，合并云端数据引起的变化也写入保存日志
+        """
         self.username = username
-        self.is_connected = False  # 默认设置为离线状态
+        self.device_id = device_id
+        self.history_log = history_log
         
         # 本地数据路径
         self.local_data_path = Path(f'data/users/{username}/work_time.json')
         
-        # 如果MongoDB可用，尝试连接
-        if MONGODB_AVAILABLE:
-            try:
-                # 加载环境变量
-                load_dotenv()
-                
-                # MongoDB配置
-                self.uri = os.getenv('MONGODB_URI')
-                self.db_name = os.getenv('MONGODB_DB', 'work_timer')
-                self.collection_name = os.getenv('MONGODB_COLLECTION', 'user_data')
-                
-                if self.uri:
-                    self.client = MongoClient(self.uri)
-                    self.db = self.client[self.db_name]
-                    self.collection = self.db[self.collection_name]
-                    # 测试连接
-                    self.client.admin.command('ping')
-                    print("MongoDB连接成功")
-                    self.is_connected = True  # 连接成功，设置为在线状态
-                else:
-                    print("未设置MongoDB URI，使用本地同步模式")
-            except Exception as e:
-                print(f"MongoDB连接失败: {e}，使用本地同步模式")
-                self.is_connected = False  # 确保连接失败时设置为离线状态
-        else:
-            print("未安装MongoDB依赖，使用本地同步模式")
+        # 同步状态：每天每台设备的计数器、已被云端确认的计数器值和哈希树
+        self.sync_state_path = Path(f'data/users/{username}/sync_state.json')
+        self.load_sync_state()
+        
+        # 离线发件箱：未能上传的计数器改动，联网后批量回放
+        self.outbox_path = Path(f'data/users/{username}/outbox.jsonl')
+        self.load_outbox()
+        
+        # 累计传输的数据量（按JSON长度估算），供同步调度统计
+        self.transfer_bytes = 0
+        
+        # 最近一次同步中其他设备新增的时长 {日期: 秒数}，以及写入合并结果的时间
+        self.remote_added = {}
+        self.merged_at = None
         
-        # 启动自动同步线程
-        self.start_auto_sync()
+        # 配置了后端地址时通过REST API同步，否则直接使用共享的MongoDB连接
+        http_connection = get_http_connection()
+        if http_connection is not None and http_connection.available:
+            self.connection = http_connection
+            self.transport = HttpTransport(http_connection, username, device_id, self.etag)
+            self.pack_history = False
+        else:
+            self.connection = get_connection_manager()
+            self.collection_name = os.getenv('MONGODB_COLLECTION', 'user_data')
+            self.transport = MongoTransport(username, self.connection, self.collection_name, device_id)
+            # 可选：将当月以前的历史按年打包压缩（旧版客户端无法读取打包数据）
+            self.pack_history = os.getenv('MONGODB_PACK_HISTORY', '').lower() in ('1', 'true', 'yes')
+        if self.connection.ensure_connected():
+            print("云端连接成功")
+        # 定期同步和变更订阅由SyncWorker负责，重连由连接管理器负责
     
-    def start_auto_sync(self):
-        """启动自动同步线程"""
-        def auto_sync():
-            while True:
-                try:
-                    # 每10分钟同步一次
-                    time.sleep(600)
-                    self.sync_data()
-                except Exception as e:
-                    print(f"自动同步出错: {e}")
+    @property
+    def is_connected(self):
+        """云端连接状态（来自共享连接管理器）"""
+        return self.connection.is_connected
+    
+    def reconnect(self):
+        """未连接时尝试重新连接，返回当前连接状态"""
+        return self.connection.ensure_connected()
+    
+    def load_sync_state(self):
+        """加载每日各设备的计数器、已确认的计数器值和哈希树"""
+        try:
+            with open(self.sync_state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        except Exception as e:
+            print(f"加载同步状态失败: {e}")
+            state = {}
+            
+        self.counters = state.get('counters')
+        self.acked = state.get('acked_cells', {})
+        self.etag = state.get('etag')
+        self.packed_before = state.get('packed_before')
+        self.offsets = state.get('offsets', {})
+        self.legacy_pending = state.get('legacy_pending', False)
+        if self.counters is None:
+            # 首次使用按设备计数或同步状态丢失：云端可能已有本设备和其他设备的计数，
+            # 等第一次下载合并后再把本地历史中云端没有覆盖的部分记为旧版数据
+            self.counters = {}
+            self.acked = {}
+            self.etag = None
+            self.legacy_pending = any(day_total(entry) > 0
+                                      for entry in self.history_days(self.load_local_data()).values())
+            
+        if self.counters and 'merkle_days' not in state:
+            self.tree = HistoryHashTree.from_counters(self.counters)
+        else:
+            self.tree = HistoryHashTree(state.get('merkle_days'))
+            
+    def save_sync_state(self):
+        """原子地保存计数器、已确认的计数器值和哈希树"""
+        try:
+            self.sync_state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.sync_state_path.with_suffix('.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'counters': self.counters,
+                    'acked_cells': self.acked,
+                    'merkle_days': self.tree.by_month,
+                    'packed_before': self.packed_before,
+                    'offsets': self.offsets,
+                    'legacy_pending': self.legacy_pending,
+                    'etag': self.transport.etag if getattr(self, 'transport', None) else self.etag
+                }, f, ensure_ascii=False)
+            os.replace(tmp_file, self.sync_state_path)
+        except Exception as e:
+            print(f"保存同步状态失败: {e}")
+    
+    def load_outbox(self):
+        """加载离线发件箱，同一个计数器只保留最大值"""
+        self.outbox = {}
+        try:
+            with open(self.outbox_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 忽略写入中断导致的残缺行
+                    cell = (record['day'], record['device'])
+                    self.outbox[cell] = max(self.outbox.get(cell, 0), record['value'])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"加载离线发件箱失败: {e}")
+        # 已被云端确认的改动无需再回放
+        self.outbox = {cell: value for cell, value in self.outbox.items()
+                       if value > self.acked.get(cell[0], {}).get(cell[1], -1)}
         
-        # 启动后台线程
-        sync_thread = threading.Thread(target=auto_sync, daemon=True)
-        sync_thread.start()
+    def queue_changes(self, changes):
+        """将计数器改动追加到离线发件箱"""
+        lines = []
+        for (day, device), value in changes.items():
+            if value > self.outbox.get((day, device), -1):
+                self.outbox[(day, device)] = value
+                lines.append(json.dumps({'day': day, 'device': device, 'value': value, 'ts': time.time()},
+                                        ensure_ascii=False))
+        if not lines:
+            return
+        try:
+            self.outbox_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.outbox_path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+        except Exception as e:
+            print(f"写入离线发件箱失败: {e}")
+            
+    def clear_outbox(self):
+        """清空离线发件箱"""
+        self.outbox = {}
+        try:
+            self.outbox_path.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"清空离线发件箱失败: {e}")
+    
+    @staticmethod
+    def history_days(data):
+        """从数据中去掉元数据字段，只保留按日期的历史记录"""
+        return {key: value for key, value in data.items() if key not in META_FIELDS}
+    
+    def record_local(self, data):
+        """将本地每日总时长中超出其他设备计数（和本地偏移）的部分记到本设备的计数器上
+
+        界面在每次同步后都会加上其他设备新增的时长（见sync_data的remote_added），
+        因此本地总时长减去其他设备的计数就是本设备的工作时长。
+        """
+        if self.legacy_pending:
+            return  # 尚未与云端合并，无法区分本设备和其他设备的时长
+        for day, entry in self.history_days(data).items():
+            total = day_total(entry) - self.offsets.get(day, 0)
+            cells = self.counters.setdefault(day, {})
+            others = sum(value for device, value in cells.items() if device != self.device_id)
+            own = cells.get(self.device_id, 0)
+            if total - others > own:
+                cells[self.device_id] = total - others
+                self.tree.update(day, cells)
+            elif not cells:
+                del self.counters[day]
+    
+    def pending_changes(self, data=None):
+        """返回尚未被云端确认的计数器 {(日期, 设备): 值}"""
+        if data is not None:
+            self.record_local(data)
+        changes = {}
+        for day, cells in self.counters.items():
+            acked = self.acked.get(day, {})
+            for device, value in cells.items():
+                if value > acked.get(device, -1):
+                    changes[(day, device)] = value
+        return changes
+    
+    def merge_cells(self, cloud_cells):
+        """合并云端计数器：逐个取最大值，云端已有的值记为已确认"""
+        for day, cells in cloud_cells.items():
+            local = self.counters.setdefault(day, {})
+            acked = self.acked.setdefault(day, {})
+            changed = False
+            for device, value in cells.items():
+                if value > local.get(device, -1):
+                    local[device] = value
+                    changed = True
+                if value > acked.get(device, -1):
+                    acked[device] = value
+            if changed:
+                self.tree.update(day, local)
+    
+    def others_totals(self):
+        """每天其他设备（含旧版数据）的计数之和"""
+        return {day: sum(value for device, value in cells.items() if device != self.device_id)
+                for day, cells in self.counters.items()}
+    
+    def adopt_legacy(self, local_data):
+        """同步状态重建后第一次合并云端：本地历史中云端计数没有覆盖的部分记为旧版数据"""
+        for day, entry in local_data.items():
+            cells = self.counters.setdefault(day, {})
+            missing = day_total(entry) - self.offsets.get(day, 0) - sum(cells.values())
+            if missing > 0:
+                cells[LEGACY_DEVICE] = cells.get(LEGACY_DEVICE, 0) + missing
+                self.tree.update(day, cells)
+            elif not cells:
+                del self.counters[day]
+        self.legacy_pending = False
     
     def load_local_data(self):
         """加载本地数据"""
@@ -90,104 +295,186 @@ class CloudSync:
             print(f"保存本地数据失败: {e}")
             return False
     
+    def log_changes(self, before, after):
+        """将合并后发生变化的日期追加到保存日志，按时间点恢复时不会丢失其他设备的时长"""
+        if self.history_log is None:
+            return
+        for day, entry in after.items():
+            if entry != before.get(day):
+                try:
+                    self.history_log.append(day, entry, after)
+                except Exception as e:
+                    print(f"写入保存日志失败: {e}")
+                    return
+    
     def upload_data(self, data):
-        """上传数据到云端"""
+        """上传数据到云端
+        
+        只上传尚未被确认的计数器（$max days.<日期>.devices.<设备>），
+        没有变化时不访问云端。离线时改动写入发件箱，
+        联网后连同发件箱中的积压一起分批上传。
+        """
+        changes = self.pending_changes(data)
         if not self.is_connected:
+            self.queue_changes(changes)
+            self.save_sync_state()
             return False
             
-        try:
-            # 添加同步时间戳
-            data['last_sync'] = datetime.now().isoformat()
-            data['username'] = self.username
+        # 发件箱中的积压与本次改动合并，同一计数器取最大值
+        batch = dict(self.outbox)
+        for cell, value in changes.items():
+            batch[cell] = max(batch.get(cell, value), value)
+        if not batch:
+            return True
             
-            # 更新云端数据
-            self.collection.update_one(
-                {'username': self.username},
-                {'$set': data},
-                upsert=True
-            )
+        try:
+            cells = list(batch.items())
+            for start in range(0, len(cells), UPLOAD_BATCH_SIZE):
+                chunk = cells[start:start + UPLOAD_BATCH_SIZE]
+                # $max为幂等操作且满足交换律，重放和多设备并发写入都不会出错
+                self.transport.push_cells(chunk)
+                self.transfer_bytes += len(json.dumps(chunk))
+                
+                # 云端已确认，记录为已上传
+                for (day, device), value in chunk:
+                    self.acked.setdefault(day, {})[device] = value
+                
+            self.connection.report_success()
+            self.save_sync_state()
+            self.clear_outbox()
             return True
         except Exception as e:
             print(f"上传数据失败: {e}")
-            self.is_connected = False  # 连接可能已断开
+            self.connection.report_failure(e)  # 连接可能已断开
+            self.queue_changes({cell: value for cell, value in changes.items()
+                                if value > self.acked.get(cell[0], {}).get(cell[1], -1)})
+            self.save_sync_state()
             return False
     
     def download_data(self):
-        """从云端下载数据"""
+        """从云端下载与本地哈希不同的计数器
+        
+        Returns:
+            (计数器 {日期: {设备: 秒数}}, 哈希写回范围)，失败时返回(None, None)
+        """
         if not self.is_connected:
-            return None
+            return None, None
             
         try:
-            data = self.collection.find_one({'username': self.username})
-            if data:
-                del data['_id']  # 删除MongoDB的_id字段
-            return data
+            cells, scope = self.transport.pull_changed_cells(self.tree)
+            self.transfer_bytes += len(json.dumps(cells))
+            self.connection.report_success()
+            return cells, scope
         except Exception as e:
             print(f"下载数据失败: {e}")
-            self.is_connected = False  # 连接可能已断开
-            return None
+            self.connection.report_failure(e)  # 连接可能已断开
+            return None, None
+    
+    def publish_hashes(self, scope):
+        """将合并后的哈希写回云端，失败不影响本次同步"""
+        try:
+            self.transport.publish_hashes(self.tree, scope)
+        except Exception as e:
+            print(f"写回哈希失败: {e}")
+    
+    def pack_closed_months(self):
+        """每月第一次同步时将当月以前的历史按年打包（需设置MONGODB_PACK_HISTORY）"""
+        if not self.pack_history:
+            return
+        current_month = datetime.now().strftime('%Y-%m')
+        if self.packed_before == current_month:
+            return
+            
+        years = {}
+        for day, cells in self.counters.items():
+            if day[:7] < current_month and cells and is_packable(day):
+                years.setdefault(day[:4], {})[day] = cells
+        # 只重写包含新结束月份的年份
+        if self.packed_before:
+            years = {year: days for year, days in years.items()
+                     if any(day[:7] >= self.packed_before for day in days)}
+        try:
+            if years and not self.transport.pack_days(years):
+                return  # 期间有其他设备上传，下次同步再打包
+            self.packed_before = current_month
+            self.save_sync_state()
+        except Exception as e:
+            print(f"打包历史数据失败: {e}")
     
     def sync_data(self):
         """同步数据
-        1. 获取本地数据
-        2. 获取云端数据
-        3. 合并数据（使用最新的数据）
-        4. 保存到本地和云端
+        1. 获取本地数据，上传本设备尚未确认的计数器
+        2. 比较哈希树，只获取云端与本地不同的计数器
+        3. 逐个计数器取最大值合并，每天的总时长为各设备计数之和加本地偏移
+        4. 保存到本地，remote_added记录每天其他设备新增的时长，供界面加到当前计时上
         """
-        local_data = self.load_local_data()
+        self.remote_added = {}
+        local_data = self.history_days(self.load_local_data())
         
         # 如果未连接，尝试重新连接
-        if not self.is_connected and MONGODB_AVAILABLE:
-            try:
-                # 测试连接
-                if hasattr(self, 'client'):
-                    self.client.admin.command('ping')
-                    self.is_connected = True
-                    print("MongoDB重新连接成功")
-            except Exception as e:
-                print(f"MongoDB重新连接失败: {e}")
-                self.is_connected = False
+        self.reconnect()
         
         # 如果仍未连接，只使用本地数据
         if not self.is_connected:
             return local_data
             
-        # 尝试下载云端数据
         try:
-            cloud_data = self.download_data()
-            
-            if not cloud_data:
-                # 如果没有云端数据，上传本地数据
-                if local_data:
-                    self.upload_data(local_data)
+            # 先上传本地尚未确认的改动（同步状态重建后要先合并云端再上传）
+            if not self.legacy_pending and not self.upload_data(local_data):
                 return local_data
                 
-            if not local_data:
-                # 如果没有本地数据，使用云端数据
-                self.save_local_data(cloud_data)
-                return cloud_data
-                
-            # 比较时间戳，使用最新的数据
-            local_time = datetime.fromisoformat(local_data.get('last_sync', '2000-01-01T00:00:00'))
-            cloud_time = datetime.fromisoformat(cloud_data.get('last_sync', '2000-01-01T00:00:00'))
-            
-            if local_time > cloud_time:
-                # 本地数据更新，上传到云端
-                self.upload_data(local_data)
+            cloud_cells, scope = self.download_data()
+            if cloud_cells is None:
                 return local_data
-            else:
-                # 云端数据更新，保存到本地
-                self.save_local_data(cloud_data)
-                return cloud_data
+            others_before = self.others_totals()
+            self.merge_cells(cloud_cells)
+            if self.legacy_pending:
+                self.adopt_legacy(local_data)
+                if not self.upload_data(local_data):
+                    return local_data
+                others_before = None  # 本地总时长已包含云端的计数，按合并前后的差值计算
+            self.save_sync_state()
+            # 此时本地计数器已全部上传且包含云端的内容，哈希与云端一致
+            self.publish_hashes(scope)
+            self.pack_closed_months()
+            
+            # 按合并后的计数器重建每天的总时长，保留本地的运行状态
+            merged = dict(local_data)
+            others_after = self.others_totals()
+            for day, cells in self.counters.items():
+                total = max(0, sum(cells.values()) + self.offsets.get(day, 0))
+                entry = merged.get(day)
+                if entry is None and total <= 0:
+                    continue  # 恢复时删除的日期
+                if isinstance(entry, dict):
+                    entry = dict(entry)
+                else:
+                    entry = {'is_running': False, 'start_time': None}
+                entry['accumulated_time'] = total
+                merged[day] = entry
+                if others_before is None:
+                    added = total - day_total(local_data.get(day))
+                else:
+                    added = others_after.get(day, 0) - others_before.get(day, 0)
+                if added > 0:
+                    self.remote_added[day] = added
+            
+            self.merged_at = time.monotonic()
+            if self.save_local_data(merged):
+                self.log_changes(local_data, merged)
+            return merged
         except Exception as e:
             print(f"同步数据时出错: {e}")
-            self.is_connected = False  # 出错时设置为离线状态
+            self.connection.report_failure(e)  # 出错时设置为离线状态
             return local_data
     
+    def watch_changes(self, on_change, stop_event, on_ready=None):
+        """订阅云端变更（MongoDB变更流或后端长轮询），订阅生效后调用on_ready()，阻塞直到stop_event被设置"""
+        transport = self.transport
+        if transport is None:
+            return
+        transport.watch(on_change, stop_event, on_ready)
+    
     def close(self):
-        """关闭MongoDB连接"""
-        if self.is_connected:
-            try:
-                self.client.close()
-            except:
-                pass 
\ No newline at end of file
+        """释放云同步管理器（共享连接由连接管理器统一关闭）"""
+        self.transport = None
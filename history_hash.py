@@ -0,0 +1,71 @@
+import hashlib
+
+
+class HistoryHashTree:
+    """历史数据的三层哈希树（根 -> 月 -> 日）
+
+    日哈希由当天各设备的计数器计算，月哈希由当月各日哈希计算，
+    根哈希由各月哈希计算。某一天变化时只需重算该日、所在月和根。
+    同步时先比较根哈希，不同再比较月哈希，最后只下载哈希不同的日期。
+    """
+
+    def __init__(self, by_month=None):
+        """初始化哈希树
+
+        Args:
+            by_month: {年月: {日期: 日哈希}}，通常来自sync_state.json
+        """
+        self.by_month = {month: dict(days) for month, days in (by_month or {}).items()}
+        self.months = {}
+        self.dirty_months = set(self.by_month)
+        self.root_hash = None
+
+    @classmethod
+    def from_counters(cls, counters):
+        """由每日各设备的计数器构建哈希树"""
+        tree = cls()
+        for day, cells in counters.items():
+            tree.update(day, cells)
+        return tree
+
+    @staticmethod
+    def digest(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def hash_cells(cls, cells):
+        """计算一天的哈希，数值统一保留三位小数，避免整数和浮点表示不同"""
+        return cls.digest(';'.join(f"{device}={float(value):.3f}" for device, value in sorted(cells.items())))
+
+    def update(self, day, cells):
+        """更新一天的哈希，返回哈希是否变化"""
+        month = day[:7]
+        day_hash = self.hash_cells(cells)
+        days = self.by_month.setdefault(month, {})
+        if days.get(day) == day_hash:
+            return False
+        days[day] = day_hash
+        self.dirty_months.add(month)
+        self.root_hash = None
+        return True
+
+    def refresh(self):
+        """重算发生变化的月哈希和根哈希"""
+        if not self.dirty_months and self.root_hash is not None:
+            return
+        for month in self.dirty_months:
+            days = self.by_month.get(month, {})
+            self.months[month] = self.digest(';'.join(f"{day}:{value}" for day, value in sorted(days.items())))
+        self.dirty_months = set()
+        self.root_hash = self.digest(';'.join(f"{month}:{value}" for month, value in sorted(self.months.items())))
+
+    def root(self):
+        self.refresh()
+        return self.root_hash
+
+    def month_hashes(self):
+        self.refresh()
+        return dict(self.months)
+
+    def day_hash(self, day):
+        return self.by_month.get(day[:7], {}).get(day)
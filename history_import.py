@@ -0,0 +1,287 @@
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+
+from backup_manager import BackupManager, SETTINGS_FILE
+from history_log import HistoryLog
+
+# 合并冲突策略：同一天在现有历史和导入数据中都存在时如何处理
+CONFLICT_POLICIES = ('max', 'sum', 'replace')
+
+# 单日时长上限（秒），超过的记录视为无效
+MAX_DAY_SECONDS = 24 * 3600
+
+# 支持的日期格式
+DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y%m%d', '%Y.%m.%d')
+
+# 各种来源中可能出现的列名
+DATE_COLUMNS = ('date', '日期', 'day')
+SECONDS_COLUMNS = ('accumulated_time', 'seconds', 'duration_seconds')
+MINUTES_COLUMNS = ('minutes', 'duration_minutes')
+HOURS_COLUMNS = ('hours', '工作时长（小时）', 'duration_hours')
+DURATION_COLUMNS = ('duration', '时长')
+
+
+def detect_format(path):
+    """根据扩展名判断输入格式"""
+    suffix = Path(path).suffix.lower()
+    if suffix in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if suffix == '.csv':
+        return 'csv'
+    raise ValueError(f"无法识别的文件格式: {path}（支持 .csv / .jsonl）")
+
+
+def read_chunks(path, fmt=None, chunk_size=10000):
+    """分块读取CSV或JSON Lines文件
+
+    Yields:
+        list: 每块最多chunk_size行，每行是一个dict
+    """
+    fmt = fmt or detect_format(path)
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            rows = csv.DictReader(f)
+        elif fmt == 'jsonl':
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            raise ValueError(f"不支持的格式: {fmt}")
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+
+def _pick_column(columns, candidates):
+    """在列名中查找第一个匹配的候选列"""
+    lowered = {column.strip().lower(): column for column in columns if column}
+    for candidate in candidates:
+        if candidate.lower() in lowered:
+            return lowered[candidate.lower()]
+    return None
+
+
+def _parse_date(value):
+    """将各种日期写法规范化为YYYY-MM-DD，无法解析时返回None"""
+    text = str(value).strip()
+    # ISO时间戳只取日期部分
+    if 'T' in text:
+        text = text.split('T', 1)[0]
+    elif ' ' in text:
+        text = text.split(' ', 1)[0]
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_clock(value):
+    """解析HH:MM[:SS]格式的时长，返回秒数"""
+    parts = [float(part) for part in str(value).strip().split(':')]
+    if len(parts) == 2:
+        parts.append(0)
+    if len(parts) != 3:
+        raise ValueError(value)
+    hours, minutes, seconds = parts
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def normalize_batch(rows):
+    """批量校验并规范化一块记录
+
+    列的识别只对每块做一次，日期解析结果在块内缓存，
+    同一天的多条记录在块内先行累加。
+
+    Returns:
+        tuple: ({日期: 秒数}, [(行内容, 错误原因)])
+    """
+    totals = {}
+    errors = []
+    if not rows:
+        return totals, errors
+
+    columns = list(rows[0].keys())
+    date_column = _pick_column(columns, DATE_COLUMNS)
+    if date_column is None:
+        return totals, [(row, "缺少日期列") for row in rows]
+
+    # 按优先级确定时长列以及换算成秒的方式
+    converters = (
+        (SECONDS_COLUMNS, float),
+        (MINUTES_COLUMNS, lambda v: float(v) * 60),
+        (HOURS_COLUMNS, lambda v: float(v) * 3600),
+        (DURATION_COLUMNS, _parse_clock),
+    )
+    duration_column = None
+    to_seconds = None
+    for candidates, converter in converters:
+        duration_column = _pick_column(columns, candidates)
+        if duration_column is not None:
+            to_seconds = converter
+            break
+    if duration_column is None:
+        return totals, [(row, "缺少时长列") for row in rows]
+
+    date_cache = {}
+    for row in rows:
+        raw_date = row.get(date_column)
+        if raw_date not in date_cache:
+            date_cache[raw_date] = _parse_date(raw_date) if raw_date not in (None, '') else None
+        day = date_cache[raw_date]
+        if day is None:
+            errors.append((row, f"无效日期: {raw_date}"))
+            continue
+
+        raw_duration = row.get(duration_column)
+        try:
+            seconds = to_seconds(raw_duration)
+        except (TypeError, ValueError):
+            errors.append((row, f"无效时长: {raw_duration}"))
+            continue
+        if not math.isfinite(seconds):
+            # nan/inf无法写入合法的JSON
+            errors.append((row, f"无效时长: {raw_duration}"))
+            continue
+        if seconds < 0 or seconds > MAX_DAY_SECONDS:
+            errors.append((row, f"时长超出范围: {raw_duration}"))
+            continue
+
+        totals[day] = totals.get(day, 0) + seconds
+    return totals, errors
+
+
+def merge_day(existing, imported_seconds, policy):
+    """按冲突策略合并一天的数据，保留现有记录的运行状态
+
+    Returns:
+        (合并后的记录, 是否因超过MAX_DAY_SECONDS而被截断)
+    """
+    if existing is None:
+        return {'accumulated_time': imported_seconds, 'is_running': False, 'start_time': None}, False
+    if isinstance(existing, (int, float)):
+        existing = {'accumulated_time': existing, 'is_running': False, 'start_time': None}
+    else:
+        existing = dict(existing)
+
+    current = existing.get('accumulated_time', 0)
+    clamped = False
+    if policy == 'max':
+        existing['accumulated_time'] = max(current, imported_seconds)
+    elif policy == 'sum':
+        clamped = current + imported_seconds > MAX_DAY_SECONDS
+        existing['accumulated_time'] = min(current + imported_seconds, MAX_DAY_SECONDS)
+    else:
+        existing['accumulated_time'] = imported_seconds
+    return existing, clamped
+
+
+def import_history(source, target_file, policy='max', fmt=None, chunk_size=10000, backup_dir=None,
+                   settings_file=SETTINGS_FILE, history_log=None):
+    """将外部记录导入到用户的历史数据文件
+
+    Args:
+        source: CSV或JSON Lines文件路径
+        target_file: 用户的work_time.json路径
+        policy: 冲突策略，max/sum/replace
+        fmt: 输入格式，默认按扩展名判断
+        chunk_size: 每块读取的行数
+        backup_dir: 导入前先为目标文件创建快照的备份目录，None表示不备份
+        settings_file: 备份按其中用户的保留策略和配额剪枝
+        history_log: 用户的HistoryLog，导入结果写为一个检查点，None表示不记录
+
+    Returns:
+        dict: 导入统计 {'rows', 'imported_days', 'changed_days', 'clamped_days', 'errors', 'error_samples'}，
+            clamped_days为合并后超过单日上限、被截断到MAX_DAY_SECONDS的天数
+    """
+    if policy not in CONFLICT_POLICIES:
+        raise ValueError(f"未知的冲突策略: {policy}")
+
+    # 逐块累加导入数据，内存占用只与天数有关，与行数无关
+    imported = {}
+    stats = {'rows': 0, 'imported_days': 0, 'changed_days': 0, 'clamped_days': 0, 'errors': 0, 'error_samples': []}
+    for chunk in read_chunks(source, fmt, chunk_size):
+        stats['rows'] += len(chunk)
+        totals, errors = normalize_batch(chunk)
+        for day, seconds in totals.items():
+            imported[day] = imported.get(day, 0) + seconds
+        stats['errors'] += len(errors)
+        stats['error_samples'].extend(errors[:10 - len(stats['error_samples'])])
+
+    target_file = Path(target_file)
+    try:
+        with open(target_file, 'r') as f:
+            history = json.load(f)
+    except FileNotFoundError:
+        history = {}
+
+    if backup_dir is not None and target_file.exists():
+        BackupManager.from_settings(backup_dir, settings_file).create_snapshot(target_file)
+
+    for day, seconds in imported.items():
+        merged, clamped = merge_day(history.get(day), min(seconds, MAX_DAY_SECONDS), policy)
+        if clamped or seconds > MAX_DAY_SECONDS:
+            stats['clamped_days'] += 1
+        if merged != history.get(day):
+            history[day] = merged
+            stats['changed_days'] += 1
+    stats['imported_days'] = len(imported)
+
+    # 原子写入，避免导入中途出错损坏历史数据
+    target_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = target_file.with_suffix('.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(dict(sorted(history.items())), f, indent=4)
+    os.replace(tmp_file, target_file)
+
+    # 导入结果写入保存日志，之后按时间点恢复不会丢失导入的历史
+    if history_log is not None and stats['changed_days']:
+        history_log.checkpoint(history)
+    return stats
+
+
+def main(argv=None):
+    """命令行入口：pimer import <文件> --user <用户名>"""
+    parser = argparse.ArgumentParser(prog='pimer import', description='导入历史工作时长记录')
+    parser.add_argument('source', help='CSV或JSON Lines文件')
+    parser.add_argument('--user', required=True, help='导入到的用户名')
+    parser.add_argument('--policy', choices=CONFLICT_POLICIES, default='max',
+                        help='同一天已有记录时的合并策略（默认max）')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help='输入格式，默认按扩展名判断')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='每块读取的行数')
+    args = parser.parse_args(argv)
+
+    user_dir = Path(f'data/users/{args.user}')
+    try:
+        stats = import_history(
+            args.source,
+            user_dir / 'work_time.json',
+            policy=args.policy,
+            fmt=args.format,
+            chunk_size=args.chunk_size,
+            backup_dir=user_dir / 'backups',
+            history_log=HistoryLog(user_dir)
+        )
+    except Exception as e:
+        print(f"导入失败: {e}")
+        return 1
+
+    print(f"读取{stats['rows']}行，导入{stats['imported_days']}天，更新{stats['changed_days']}天，"
+          f"无效记录{stats['errors']}条")
+    if stats['clamped_days']:
+        print(f"  {stats['clamped_days']}天合并后超过24小时，已截断为24小时")
+    for row, reason in stats['error_samples']:
+        print(f"  {reason}: {row}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime
+from pathlib import Path
+
+
+class HistoryLog:
+    """保存日志与稀疏检查点
+
+    每次保存当天数据时向history.log追加一行记录，
+    每隔CHECKPOINT_INTERVAL条记录写一次完整状态的检查点。
+    按时间点恢复时，先二分查找不晚于该时间的最近检查点，
+    再从检查点记录的日志偏移处开始重放，直到目标时间。
+    """
+
+    LOG_FILE = 'history.log'
+    CHECKPOINT_DIR = 'checkpoints'
+    CHECKPOINT_INTERVAL = 1000
+
+    def __init__(self, user_dir):
+        self.user_dir = Path(user_dir)
+        self.log_file = self.user_dir / self.LOG_FILE
+        self.checkpoint_dir = self.user_dir / self.CHECKPOINT_DIR
+        self.index_file = self.checkpoint_dir / 'index.json'
+        self.lock = threading.Lock()
+        self.load_index()
+
+    def load_index(self):
+        """加载检查点索引"""
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            self.checkpoints = [tuple(item) for item in index.get('checkpoints', [])]
+            self.records_since_checkpoint = index.get('records_since_checkpoint', 0)
+        except FileNotFoundError:
+            self.checkpoints = []  # [(时间戳, 日志偏移, 检查点文件名)]，按时间排序
+            self.records_since_checkpoint = 0
+        except Exception as e:
+            print(f"加载检查点索引失败: {e}")
+            self.checkpoints = []
+            self.records_since_checkpoint = 0
+
+    def save_index(self):
+        """原子地写入检查点索引"""
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        index = {
+            'checkpoints': self.checkpoints,
+            'records_since_checkpoint': self.records_since_checkpoint
+        }
+        tmp_file = self.index_file.with_suffix('.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_file, self.index_file)
+
+    def append(self, day, entry, state, timestamp=None):
+        """追加一条保存记录
+
+        Args:
+            day: 日期字符串
+            entry: 当天的数据
+            state: 保存后的完整历史数据，用于写检查点
+            timestamp: 记录时间（秒），默认当前时间
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        with self.lock:
+            self.user_dir.mkdir(parents=True, exist_ok=True)
+            line = json.dumps({'ts': timestamp, 'day': day, 'entry': entry}, separators=(',', ':'))
+            with open(self.log_file, 'ab') as f:
+                f.write(line.encode('utf-8') + b'\n')
+                offset = f.tell()
+
+            self.records_since_checkpoint += 1
+            # 没有检查点时立即写一个，作为重放的基线
+            if not self.checkpoints or self.records_since_checkpoint >= self.CHECKPOINT_INTERVAL:
+                self._write_checkpoint(timestamp, offset, state)
+            elif self.records_since_checkpoint % 100 == 0:
+                self.save_index()
+
+    def checkpoint(self, state, timestamp=None):
+        """在日志末尾写一个完整状态的检查点
+
+        导入和恢复会整体改写work_time.json（恢复还可能删除日期），
+        写入检查点后，之后按时间点恢复时也包含这些改动。
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        with self.lock:
+            self.user_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                offset = self.log_file.stat().st_size
+            except FileNotFoundError:
+                offset = 0
+            self._write_checkpoint(timestamp, offset, state)
+
+    def _write_checkpoint(self, timestamp, offset, state):
+        """写入一个完整状态的检查点，offset为其后第一条记录的日志偏移"""
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        name = f"checkpoint_{int(timestamp * 1000)}.json"
+        with open(self.checkpoint_dir / name, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        self.checkpoints.append((timestamp, offset, name))
+        self.records_since_checkpoint = 0
+        self.save_index()
+
+    def restore(self, moment):
+        """重建指定时间点的历史数据
+
+        Args:
+            moment: datetime或时间戳（秒）
+
+        Returns:
+            dict: 该时间点的历史数据；早于第一个检查点时返回None
+        """
+        target = moment.timestamp() if isinstance(moment, datetime) else float(moment)
+        position = bisect_right(self.checkpoints, (target, float('inf'), '')) - 1
+        if position < 0:
+            return None
+
+        _, offset, name = self.checkpoints[position]
+        with open(self.checkpoint_dir / name, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+
+        # 从检查点之后的位置开始重放，遇到晚于目标时间的记录即停止
+        try:
+            with open(self.log_file, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 忽略写入中断导致的残缺行
+                    if record['ts'] > target:
+                        break
+                    state[record['day']] = record['entry']
+        except FileNotFoundError:
+            pass
+        return state
+
+
+def main(argv=None):
+    """命令行入口：pimer restore --user <用户名> --at <时间>"""
+    parser = argparse.ArgumentParser(prog='pimer restore', description='按时间点恢复历史数据')
+    parser.add_argument('--user', required=True, help='用户名')
+    parser.add_argument('--at', required=True, help='时间点，ISO格式，如2025-03-01T18:00:00')
+    parser.add_argument('--output', help='输出文件，默认覆盖用户的work_time.json（会先备份）')
+    args = parser.parse_args(argv)
+
+    try:
+        moment = datetime.fromisoformat(args.at)
+    except ValueError:
+        print(f"无效的时间: {args.at}")
+        return 1
+
+    user_dir = Path(f'data/users/{args.user}')
+    history_log = HistoryLog(user_dir)
+    state = history_log.restore(moment)
+    if state is None:
+        print(f"{args.at} 之前没有可用的保存记录")
+        return 1
+
+    if args.output:
+        output = Path(args.output)
+    else:
+        from backup_manager import BackupManager
+        output = user_dir / 'work_time.json'
+        BackupManager.from_settings(user_dir / 'backups').create_snapshot(output)
+
+    tmp_file = output.with_suffix('.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp_file, output)
+    if not args.output:
+        # 恢复本身也写入保存日志，之后按时间点恢复时会重放这次恢复
+        history_log.checkpoint(state)
+        # 恢复只在本机生效，同步不会用云端的计数把恢复的日期改回去
+        from cloud_sync import record_restore
+        record_restore(user_dir, state)
+    print(f"已恢复到 {args.at}，共{len(state)}天，写入 {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
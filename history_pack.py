@@ -0,0 +1,55 @@
+import struct
+import zlib
+from datetime import date, timedelta
+
+# 打包格式：魔数、设备数，然后每台设备为名称和366个float64（按一年中的第几天排列）
+PACK_MAGIC = b'PH1'
+DAYS_PER_YEAR = 366
+VALUES_FORMAT = f'<{DAYS_PER_YEAR}d'
+
+
+def is_packable(day):
+    """只有合法的日期才能按一年中的第几天打包"""
+    try:
+        date.fromisoformat(day)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def pack_year(days):
+    """将一年的计数器 {日期: {设备: 秒数}} 打包为zlib压缩的定长数组"""
+    devices = sorted({device for cells in days.values() for device in cells})
+    parts = [PACK_MAGIC, struct.pack('<H', len(devices))]
+    for device in devices:
+        values = [0.0] * DAYS_PER_YEAR
+        for day, cells in days.items():
+            values[date.fromisoformat(day).timetuple().tm_yday - 1] = float(cells.get(device, 0))
+        name = device.encode('utf-8')
+        parts.append(struct.pack('<B', len(name)) + name + struct.pack(VALUES_FORMAT, *values))
+    return zlib.compress(b''.join(parts), 9)
+
+
+def unpack_year(year, blob):
+    """解包一年的计数器，返回 {日期: {设备: 秒数}}，没有记录的日期不出现"""
+    raw = zlib.decompress(bytes(blob))
+    if raw[:len(PACK_MAGIC)] != PACK_MAGIC:
+        raise ValueError(f"无法识别的历史数据打包格式: {year}")
+    offset = len(PACK_MAGIC)
+    count, = struct.unpack_from('<H', raw, offset)
+    offset += 2
+
+    start = date(int(year), 1, 1)
+    days = {}
+    for _ in range(count):
+        length = raw[offset]
+        offset += 1
+        device = raw[offset:offset + length].decode('utf-8')
+        offset += length
+        values = struct.unpack_from(VALUES_FORMAT, raw, offset)
+        offset += struct.calcsize(VALUES_FORMAT)
+        for index, value in enumerate(values):
+            if value > 0:
+                day = start + timedelta(days=index)
+                days.setdefault(day.isoformat(), {})[device] = value
+    return days
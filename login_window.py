@@ -1,8 +1,9 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from datetime import datetime
 import os
 import sys
+import queue
+import threading
 
 def resource_path(relative_path):
     """获取资源的绝对路径"""
@@ -296,7 +297,15 @@ class LoginWindow:
         self.reg_username_entry.focus_set()
         
     def handle_login(self):
-        """处理登录"""
+        """处理登录
+        
+        先用本地账户存储验证，通过后立即进入应用，云端复核和登录时间更新在后台进行，
+        结果由主窗口处理。本地无法验证（新设备或密码已在其他设备修改）时，
+        在后台线程中向云端验证，窗口保持响应。
+        """
+        if getattr(self, 'login_pending', False):
+            return
+            
         username = self.username_var.get().strip()
         password = self.password_var.get()
         
@@ -306,99 +315,68 @@ class LoginWindow:
             messagebox.showerror("错误", "请输入用户名和密码")
             return
         
-        # 尝试在登录前同步用户数据
-        if hasattr(self.user_manager, 'is_connected') and self.user_manager.is_connected:
+        success, message = self.user_manager.login_local(username, password)
+        if success:
+            self.user_manager.revalidate_login(username, password)
+            self.finish_login(message)
+            return
+            
+        if not self.user_manager.connection.available:
+            self.show_login_error(message)
+            return
+            
+        # 在后台向云端验证，结果通过队列交回UI线程
+        print("本地验证未通过，在后台向云端验证")
+        self.login_pending = True
+        self.window.config(cursor="watch")
+        results = queue.Queue()
+        
+        def remote_login():
             try:
-                # 显示同步中提示
-                self.window.config(cursor="wait")
-                self.window.update()
-                
-                # 尝试直接从云端获取用户
-                print(f"尝试直接从云端获取用户: {username}")
-                cloud_user = self.user_manager.get_cloud_user(username)
-                
-                if cloud_user:
-                    print(f"云端找到用户: {username}")
-                    hashed_password = self.user_manager.hash_password(password)
-                    cloud_password = cloud_user.get('password')
-                    print(f"云端密码: {cloud_password[:10]}...")
-                    print(f"输入密码哈希: {hashed_password[:10]}...")
-                    
-                    if cloud_user.get('password') == self.user_manager.hash_password(password):
-                        print(f"云端密码验证成功: {username}")
-                        # 如果云端验证成功，更新本地用户
-                        login_time = datetime.now().isoformat()
-                        cloud_user['last_login'] = login_time
-                        
-                        # 更新云端
-                        try:
-                            self.user_manager.users_collection.update_one(
-                                {"username": username},
-                                {"$set": {"last_login": login_time}}
-                            )
-                        except Exception as e:
-                            print(f"更新云端用户登录时间失败: {e}")
-                        
-                        # 更新本地
-                        self.user_manager.users[username] = cloud_user
-                        self.user_manager.save_users()
-                        
-                        # 设置当前用户
-                        self.user_manager.current_user = username
-                        
-                        # 设置自动登录
-                        if self.auto_login_var.get():
-                            self.user_manager.set_auto_login(True)
-                        
-                        # 恢复光标
-                        self.window.config(cursor="")
-                        
-                        # 关闭窗口并回调
-                        self.window.destroy()
-                        self.on_login_success()
-                        
-                        # 显示云端登录状态提示
-                        messagebox.showinfo("登录成功", "已通过云端验证登录，您的数据将自动同步")
-                        return
-                    else:
-                        print(f"云端密码验证失败: {username}")
-                else:
-                    print(f"云端未找到用户: {username}")
-                
-                # 如果直接云端验证失败，尝试静默同步用户数据
-                print("开始静默同步用户数据")
-                self.user_manager.sync_users(force=True)
-                
-                # 恢复光标
-                self.window.config(cursor="")
+                results.put(self.user_manager.login_remote(username, password))
             except Exception as e:
-                print(f"登录前同步用户数据失败: {e}")
-                # 恢复光标
-                self.window.config(cursor="")
+                print(f"云端登录失败: {e}")
+                results.put((False, message))
+        threading.Thread(target=remote_login, daemon=True).start()
+        self.window.after(100, self.poll_login_result, results)
+        
+    def poll_login_result(self, results):
+        """检查后台云端登录的结果"""
+        if not self.window.winfo_exists():
+            return
+        try:
+            success, message = results.get_nowait()
+        except queue.Empty:
+            self.window.after(100, self.poll_login_result, results)
+            return
             
-        # 执行常规登录
-        print("执行常规登录流程")
-        success, message = self.user_manager.login(username, password)
+        self.login_pending = False
+        self.window.config(cursor="")
         print(f"登录结果: {success}, {message}")
-        
         if success:
-            # 设置自动登录
-            if self.auto_login_var.get():
-                self.user_manager.set_auto_login(True)
-            self.window.destroy()
-            self.on_login_success()
+            self.finish_login(message)
+        else:
+            self.show_login_error(message)
             
-            # 显示云端登录状态提示
-            if "云端验证" in message or "同步后验证" in message:
-                messagebox.showinfo("登录成功", "已通过云端验证登录，您的数据将自动同步")
+    def finish_login(self, message):
+        """登录成功：设置自动登录，关闭窗口并回调"""
+        if self.auto_login_var.get():
+            self.user_manager.set_auto_login(True)
+        self.window.destroy()
+        self.on_login_success()
+        
+        # 显示云端登录状态提示
+        if "云端验证" in message or "同步后验证" in message:
+            messagebox.showinfo("登录成功", "已通过云端验证登录，您的数据将自动同步")
+            
+    def show_login_error(self, message):
+        """根据错误信息显示不同的提示"""
+        if "密码错误" in message:
+            messagebox.showerror("登录失败", "密码错误")
+        elif "用户不存在" in message:
+            messagebox.showerror("登录失败", "用户不存在")
         else:
-            # 根据错误信息显示不同的提示
-            if "密码错误" in message:
-                messagebox.showerror("登录失败", "密码错误")
-            elif "用户不存在" in message:
-                messagebox.showerror("登录失败", "用户不存在")
-            else:
-                messagebox.showerror("登录失败", message)
+            messagebox.showerror("登录失败", message)
             
     def handle_register(self):
         """处理注册"""
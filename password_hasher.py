@@ -0,0 +1,115 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+
+class PasswordHasher:
+    """加盐的scrypt密码哈希
+
+    哈希格式为 scrypt$<log2 N>$<r>$<p>$<盐>$<哈希>，参数随哈希一起保存，
+    调整代价后旧哈希仍可验证，并在下次登录时按新参数重新计算。
+    兼容旧版无盐的SHA-256十六进制哈希。
+
+    验证成功的结果在内存中缓存CACHE_TTL秒，重复解锁时无需再次计算KDF；
+    缓存键是以进程内随机密钥计算的HMAC，不保存明文密码。
+    """
+
+    SCHEME = 'scrypt'
+    DEFAULT_COST = 14       # log2(N)，内存占用约为 128 * r * N 字节
+    BLOCK_SIZE = 8          # r
+    PARALLELISM = 1         # p
+    SALT_BYTES = 16
+    KEY_BYTES = 32
+    CACHE_TTL = 300         # 验证结果缓存的秒数
+    CACHE_SIZE = 64
+
+    def __init__(self, cost=DEFAULT_COST, cache_ttl=CACHE_TTL):
+        """初始化密码哈希
+
+        Args:
+            cost: scrypt的log2(N)，每加1计算时间和内存翻倍
+            cache_ttl: 验证结果缓存的秒数，0表示不缓存
+        """
+        self.cost = cost
+        self.cache_ttl = cache_ttl
+        self.cache = {}
+        self.cache_key = os.urandom(32)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def b64encode(data):
+        return base64.b64encode(data).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def b64decode(text):
+        return base64.b64decode(text + '=' * (-len(text) % 4))
+
+    @staticmethod
+    def derive(password, salt, cost, r, p, length):
+        n = 2 ** cost
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * r * n, dklen=length)
+
+    def hash(self, password):
+        """计算新的密码哈希（随机盐）"""
+        salt = os.urandom(self.SALT_BYTES)
+        key = self.derive(password, salt, self.cost, self.BLOCK_SIZE, self.PARALLELISM, self.KEY_BYTES)
+        return '$'.join([self.SCHEME, str(self.cost), str(self.BLOCK_SIZE), str(self.PARALLELISM),
+                         self.b64encode(salt), self.b64encode(key)])
+
+    @staticmethod
+    def is_legacy(stored):
+        """旧版无盐SHA-256哈希"""
+        return isinstance(stored, str) and len(stored) == 64 and '$' not in stored
+
+    def needs_rehash(self, stored):
+        """旧版哈希或代价参数与当前配置不同时需要重新计算"""
+        if self.is_legacy(stored):
+            return True
+        try:
+            scheme, cost, r, p, _, _ = stored.split('$')
+        except (AttributeError, ValueError):
+            return True
+        return (scheme != self.SCHEME or int(cost) != self.cost
+                or int(r) != self.BLOCK_SIZE or int(p) != self.PARALLELISM)
+
+    def _cache_token(self, password, stored):
+        return hmac.new(self.cache_key, f"{stored}\0{password}".encode('utf-8'), hashlib.sha256).digest()
+
+    def verify(self, password, stored):
+        """验证密码，stored为空或格式无法识别时返回False"""
+        if not stored:
+            return False
+
+        token = self._cache_token(password, stored)
+        now = time.monotonic()
+        with self.lock:
+            expires = self.cache.get(token)
+            if expires is not None and expires > now:
+                return True
+
+        if self.is_legacy(stored):
+            ok = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+        else:
+            try:
+                scheme, cost, r, p, salt, key = stored.split('$')
+                if scheme != self.SCHEME:
+                    return False
+                expected = self.b64decode(key)
+                derived = self.derive(password, self.b64decode(salt), int(cost), int(r), int(p), len(expected))
+            except (ValueError, TypeError):
+                return False
+            ok = hmac.compare_digest(derived, expected)
+
+        if ok and self.cache_ttl > 0:
+            with self.lock:
+                if len(self.cache) >= self.CACHE_SIZE:
+                    # 先清理过期项，仍然满时丢弃最早到期的一项
+                    self.cache = {k: v for k, v in self.cache.items() if v > now}
+                    if len(self.cache) >= self.CACHE_SIZE:
+                        del self.cache[min(self.cache, key=self.cache.get)]
+                self.cache[token] = now + self.cache_ttl
+        return ok
@@ -0,0 +1,113 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+
+class SessionToken:
+    """自动登录使用的本地会话令牌
+
+    令牌内容为用户名、签发时间和过期时间，使用本机随机密钥做HMAC-SHA256签名，
+    启动时只需读取并校验一个小文件即可恢复会话，不访问账户存储或云端。
+    """
+
+    DEFAULT_TTL_DAYS = 30
+
+    def __init__(self, token_file, key_file, ttl_days=DEFAULT_TTL_DAYS):
+        """初始化会话令牌
+
+        Args:
+            token_file: 令牌文件路径
+            key_file: 签名密钥文件路径（首次使用时生成）
+            ttl_days: 令牌有效天数
+        """
+        self.token_file = Path(token_file)
+        self.key_file = Path(key_file)
+        self.ttl = timedelta(days=ttl_days)
+        self.key = None
+
+    def load_key(self):
+        """读取签名密钥，不存在时生成并只允许当前用户读写"""
+        if self.key is None:
+            try:
+                self.key = self.key_file.read_bytes()
+            except FileNotFoundError:
+                self.key_file.parent.mkdir(parents=True, exist_ok=True)
+                self.key = os.urandom(32)
+                self.key_file.write_bytes(self.key)
+                try:
+                    os.chmod(self.key_file, 0o600)
+                except OSError:
+                    pass
+        return self.key
+
+    def sign(self, payload):
+        return hmac.new(self.load_key(), payload, hashlib.sha256).hexdigest()
+
+    def issue(self, username, now=None):
+        """签发（或续期）令牌"""
+        now = now or datetime.now()
+        payload = json.dumps({
+            'username': username,
+            'issued': now.isoformat(),
+            'expires': (now + self.ttl).isoformat()
+        }).encode('utf-8')
+        token = {
+            'payload': base64.urlsafe_b64encode(payload).decode('ascii'),
+            'signature': self.sign(payload)
+        }
+        try:
+            self.token_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.token_file.with_suffix('.tmp')
+            with open(tmp_file, 'w') as f:
+                json.dump(token, f)
+            os.replace(tmp_file, self.token_file)
+            return True
+        except Exception as e:
+            print(f"保存会话令牌失败: {e}")
+            return False
+
+    def read(self, now=None):
+        """读取并校验令牌，返回令牌内容；不存在、签名不符或已过期时返回None"""
+        try:
+            with open(self.token_file, 'r') as f:
+                token = json.load(f)
+            payload = base64.urlsafe_b64decode(token['payload'].encode('ascii'))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"读取会话令牌失败: {e}")
+            return None
+
+        if not hmac.compare_digest(self.sign(payload), token.get('signature', '')):
+            print("会话令牌签名无效")
+            return None
+        session = json.loads(payload)
+        if datetime.fromisoformat(session['expires']) <= (now or datetime.now()):
+            return None
+        return session
+
+    def restore(self, now=None):
+        """返回令牌中的用户名，令牌无效时返回None"""
+        session = self.read(now)
+        return session['username'] if session else None
+
+    def needs_refresh(self, now=None):
+        """剩余有效期不足一半时需要续期"""
+        session = self.read(now)
+        if session is None:
+            return False
+        remaining = datetime.fromisoformat(session['expires']) - (now or datetime.now())
+        return remaining < self.ttl / 2
+
+    def clear(self):
+        """删除令牌（登出或关闭自动登录）"""
+        try:
+            self.token_file.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"删除会话令牌失败: {e}")
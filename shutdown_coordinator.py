@@ -0,0 +1,76 @@
+import threading
+import time
+
+
+class ShutdownCoordinator:
+    """退出协调器
+
+    将退出时的各个步骤（云端上传、备份、停止文件监听、停止托盘图标等）
+    放到独立的守护线程中并行执行，并受一个全局截止时间约束。
+    超过截止时间仍未完成的步骤不会阻塞退出，而是在结果中报告为被截断。
+    """
+
+    def __init__(self, deadline=3.0):
+        """初始化退出协调器
+
+        Args:
+            deadline: 所有步骤共享的截止时间（秒）
+        """
+        self.deadline = deadline
+        self.steps = []
+
+    def add_step(self, name, func, *args):
+        """注册一个退出步骤
+
+        Args:
+            name: 步骤名称，用于结果报告
+            func: 要执行的函数
+            args: 传给函数的参数
+        """
+        self.steps.append((name, func, args))
+
+    def run(self):
+        """并行执行所有步骤，最多等待到截止时间
+
+        Returns:
+            dict: {'completed': [...], 'failed': {名称: 错误}, 'timed_out': [...], 'elapsed': 秒}
+        """
+        results = {}
+        lock = threading.Lock()
+
+        def run_step(name, func, args):
+            try:
+                func(*args)
+                outcome = None
+            except Exception as e:
+                outcome = e
+            with lock:
+                results[name] = outcome
+
+        start = time.monotonic()
+        threads = []
+        for name, func, args in self.steps:
+            thread = threading.Thread(target=run_step, args=(name, func, args),
+                                      name=f"shutdown-{name}", daemon=True)
+            thread.start()
+            threads.append((name, thread))
+
+        # 所有线程共享同一个截止时间
+        end = start + self.deadline
+        for name, thread in threads:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            thread.join(remaining)
+
+        report = {'completed': [], 'failed': {}, 'timed_out': [], 'elapsed': 0.0}
+        with lock:
+            for name, _ in threads:
+                if name not in results:
+                    report['timed_out'].append(name)
+                elif results[name] is None:
+                    report['completed'].append(name)
+                else:
+                    report['failed'][name] = results[name]
+        report['elapsed'] = time.monotonic() - start
+        return report
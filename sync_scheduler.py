@@ -0,0 +1,108 @@
+import time
+
+
+class SyncScheduler:
+    """根据计时器状态调整同步频率
+
+    计时器状态变化（开始、暂停、跨天、退出）时立即同步；
+    计时中每分钟的自动保存合并为每RUNNING_UPLOAD_INTERVAL秒上传一次；
+    暂停后拉长定期同步的间隔，长时间没有任何操作（空闲）时进一步拉长。
+    同时统计实际唤醒次数和传输字节数，以及相对固定频率节省的部分。
+    """
+
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    IDLE = 'idle'
+
+    DEBOUNCE_SECONDS = 5            # 暂停时的改动（清零、编辑）静默多久后上传
+    MAX_DELAY_SECONDS = 30          # 暂停时的改动最多等待多久上传
+    RUNNING_UPLOAD_INTERVAL = 300   # 计时中自动保存的改动合并上传的间隔（秒）
+    PAUSED_SYNC_INTERVAL = 1800     # 暂停时定期同步的最短间隔（秒）
+    IDLE_SYNC_INTERVAL = 7200       # 空闲时定期同步的最短间隔（秒）
+    IDLE_AFTER_SECONDS = 900        # 暂停且多久没有改动视为空闲
+
+    # 固定频率的基准：每次保存都上传，每600秒完整同步一次
+    BASELINE_SYNC_INTERVAL = 600
+
+    def __init__(self, running=False):
+        self.running = running
+        self.last_activity = time.monotonic()
+        self.started = self.last_activity
+
+        self.wakeups = 0
+        self.bytes = 0
+        self.uploads = 0
+        self.upload_bytes = 0
+        self.syncs = 0
+        self.sync_bytes = 0
+        self.coalesced = 0
+
+    def mode(self, now=None):
+        """当前调度模式"""
+        if self.running:
+            return self.RUNNING
+        now = time.monotonic() if now is None else now
+        if now - self.last_activity >= self.IDLE_AFTER_SECONDS:
+            return self.IDLE
+        return self.PAUSED
+
+    def on_transition(self, kind):
+        """计时器状态变化：start、pause、rollover、quit"""
+        if kind == 'start':
+            self.running = True
+        elif kind in ('pause', 'quit'):
+            self.running = False
+        self.last_activity = time.monotonic()
+
+    def on_change(self, pending):
+        """本地数据变化；pending表示已有尚未上传的改动，本次将与其合并"""
+        self.last_activity = time.monotonic()
+        if pending:
+            self.coalesced += 1
+
+    def upload_deadline(self, first_change, last_change):
+        """尚未上传的改动应在何时上传"""
+        if self.running:
+            return first_change + self.RUNNING_UPLOAD_INTERVAL
+        return min(last_change + self.DEBOUNCE_SECONDS, first_change + self.MAX_DELAY_SECONDS)
+
+    def sync_interval(self, base_interval):
+        """定期同步的间隔；base_interval取决于是否订阅了云端变更"""
+        mode = self.mode()
+        if mode == self.IDLE:
+            return max(base_interval, self.IDLE_SYNC_INTERVAL)
+        if mode == self.PAUSED:
+            return max(base_interval, self.PAUSED_SYNC_INTERVAL)
+        return base_interval
+
+    def record(self, kind, transferred):
+        """记录一次实际访问云端的操作（kind为'upload'或'sync'）"""
+        self.wakeups += 1
+        self.bytes += transferred
+        if kind == 'upload':
+            self.uploads += 1
+            self.upload_bytes += transferred
+        else:
+            self.syncs += 1
+            self.sync_bytes += transferred
+
+    def stats(self):
+        """实际与节省的唤醒次数和字节数（节省量按平均每次传输量估算）"""
+        elapsed = time.monotonic() - self.started
+        baseline_syncs = int(elapsed // self.BASELINE_SYNC_INTERVAL)
+        saved_syncs = max(0, baseline_syncs - self.syncs)
+        saved_uploads = self.coalesced
+        avg_upload = self.upload_bytes / self.uploads if self.uploads else 0
+        avg_sync = self.sync_bytes / self.syncs if self.syncs else 0
+        return {
+            'wakeups': self.wakeups,
+            'bytes': self.bytes,
+            'saved_wakeups': saved_uploads + saved_syncs,
+            'saved_bytes': int(saved_uploads * avg_upload + saved_syncs * avg_sync)
+        }
+
+    def summary(self):
+        """统计结果的文字描述"""
+        stats = self.stats()
+        return (f"同步调度：唤醒{stats['wakeups']}次，传输约{stats['bytes'] / 1024:.1f}KB；"
+                f"节省{stats['saved_wakeups']}次唤醒，约{stats['saved_bytes'] / 1024:.1f}KB")
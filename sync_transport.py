@@ -0,0 +1,329 @@
+import gzip
+import json
+import uuid
+from collections import deque
+from datetime import datetime
+
+from history_pack import pack_year, unpack_year
+
+# 尝试导入可选依赖
+try:
+    from bson import Binary
+except ImportError:
+    Binary = bytes
+
+# 云端文档中不属于历史数据的字段
+META_FIELDS = ('_id', 'username', 'last_sync', 'last_device', 'last_write', 'days', 'archive', 'rev', 'merkle_root', 'merkle_months', 'merkle_days')
+
+# 哈希树中表示"内容已变化、哈希待重算"的标记
+DIRTY_HASH = ''
+
+# 旧版数据（未按设备区分）归入的伪设备
+LEGACY_DEVICE = '_legacy'
+
+
+def day_total(entry):
+    """一天的累计时长（兼容旧格式：直接是秒数）"""
+    if isinstance(entry, (int, float)):
+        return entry
+    if isinstance(entry, dict):
+        return entry.get('accumulated_time') or 0
+    return 0
+
+
+def document_cells(document):
+    """从云端文档中解析各设备的计数器 {日期: {设备: 秒数}}
+
+    兼容旧版文档：顶层日期字段和days.<日期>.accumulated_time记为旧版数据。
+    archive.<年份>为打包的历史数据，与days中同一天的计数器逐个取最大值。
+    """
+    cells = {}
+    for day, entry in document.items():
+        if day not in META_FIELDS:
+            cells.setdefault(day, {})[LEGACY_DEVICE] = day_total(entry)
+    for day, entry in document.get('days', {}).items():
+        day_cells = cells.setdefault(day, {})
+        if isinstance(entry, dict) and 'accumulated_time' in entry:
+            day_cells[LEGACY_DEVICE] = max(day_cells.get(LEGACY_DEVICE, 0), day_total(entry))
+        if isinstance(entry, dict):
+            for device, value in entry.get('devices', {}).items():
+                day_cells[device] = max(day_cells.get(device, 0), value)
+    for year, blob in document.get('archive', {}).items():
+        for day, archived in unpack_year(year, blob).items():
+            day_cells = cells.setdefault(day, {})
+            for device, value in archived.items():
+                day_cells[device] = max(day_cells.get(device, 0), value)
+    return cells
+
+
+def rev_filter(rev):
+    """按版本号条件更新的过滤值（旧文档没有rev字段，视为0）"""
+    return {'$in': [rev, None]} if rev == 0 else rev
+
+
+class MongoTransport:
+    """直接读写MongoDB的同步传输
+
+    云端文档中保存历史数据的哈希树（merkle_root、merkle_months、merkle_days），
+    下载时逐层比较，只读取哈希不同的日期。上传计数器时把相应的日、月和根哈希
+    标记为待重算并递增rev；完成同步的客户端再以rev为条件写回新的哈希，
+    期间若有其他设备上传则放弃写回，避免留下与内容不符的哈希。
+
+    开启打包后，当月以前的历史按年打包为压缩的定长数组（archive.<年份>），
+    文档中只保留当月的days字段，长期历史的下载量可减少一个数量级。
+    """
+
+    WATCH_AWAIT_MS = 1000  # 变更流每次等待的时间，也是检查停止信号的间隔
+    OWN_WRITES = 100       # 记住本设备最近多少次写入的标记
+
+    def __init__(self, username, connection, collection_name, device_id):
+        self.username = username
+        self.connection = connection
+        self.collection = connection.get_collection(collection_name)
+        self.device_id = device_id
+        self.last_rev = None  # 最近一次比较哈希时的版本号
+        self.own_writes = deque(maxlen=self.OWN_WRITES)
+
+    def write_marker(self):
+        """生成一次写入的唯一标记（last_write），变更流据此识别本设备的写入
+
+        每次写入的值都不同，一定出现在变更事件的updatedFields中；
+        last_device连续两次写入相同的值时MongoDB不会把它列入updatedFields。
+        """
+        marker = uuid.uuid4().hex
+        self.own_writes.append(marker)  # 写入前记录，变更事件不会早于记录到达
+        return marker
+
+    def push_cells(self, cells):
+        """以$max写入一批计数器 [((日期, 设备), 值)]，并将相应的哈希标记为待重算"""
+        fields = {'last_sync': datetime.now().isoformat(), 'last_device': self.device_id,
+                  'last_write': self.write_marker(), 'merkle_root': DIRTY_HASH}
+        for (day, device), value in cells:
+            fields[f'merkle_months.{day[:7]}'] = DIRTY_HASH
+            fields[f'merkle_days.{day[:7]}.{day}'] = DIRTY_HASH
+        self.collection.update_one(
+            {'username': self.username},
+            {
+                '$max': {f'days.{day}.devices.{device}': value for (day, device), value in cells},
+                '$set': fields,
+                '$inc': {'rev': 1}
+            },
+            upsert=True
+        )
+
+    def pull_cells(self):
+        """下载全部计数器，云端没有数据时返回空字典（不下载哈希树）"""
+        document = self.collection.find_one({'username': self.username}, {'merkle_months': 0, 'merkle_days': 0})
+        return document_cells(document) if document else {}
+
+    def find_fields(self, fields):
+        """只读取文档中的指定字段"""
+        document = self.collection.find_one({'username': self.username}, {field: 1 for field in fields})
+        return document or {}
+
+    def pull_changed_cells(self, tree):
+        """比较哈希树，只下载与本地不同的日期
+
+        Args:
+            tree: 本地的HistoryHashTree
+
+        Returns:
+            (计数器, 范围)。范围记录本次比较时的rev以及检查过的月份和日期，
+            传给publish_hashes写回哈希；无需写回时为None
+        """
+        document = self.find_fields(['rev', 'merkle_root'])
+        if not document:
+            return {}, None
+        rev = document.get('rev', 0)
+        self.last_rev = rev
+
+        if 'merkle_root' not in document:
+            # 云端还没有哈希树（旧版文档），完整下载一次后写回
+            return self.pull_cells(), {'rev': rev, 'months': None, 'days': None}
+        if document['merkle_root'] == tree.root():
+            return {}, None
+
+        local_months = tree.month_hashes()
+        cloud_months = self.find_fields(['merkle_months']).get('merkle_months', {})
+        months = sorted(month for month, value in cloud_months.items() if value != local_months.get(month))
+        if not months:
+            return {}, {'rev': rev, 'months': [], 'days': []}
+
+        cloud_days = self.find_fields([f'merkle_days.{month}' for month in months]).get('merkle_days', {})
+        days = sorted(day for month in months for day, value in cloud_days.get(month, {}).items()
+                      if value != tree.day_hash(day))
+        if not days:
+            return {}, {'rev': rev, 'months': months, 'days': []}
+
+        # 已打包的日期在archive.<年份>中，一并读取所在年份的打包数据
+        years = sorted({day[:4] for day in days})
+        document = self.find_fields([f'days.{day}' for day in days] + [f'archive.{year}' for year in years])
+        cells = document_cells({'days': document.get('days', {}), 'archive': document.get('archive', {})})
+        return {day: cells[day] for day in days if day in cells}, {'rev': rev, 'months': months, 'days': days}
+
+    def publish_hashes(self, tree, scope):
+        """合并完成后写回哈希树；期间云端有新的上传（rev已变化）时放弃"""
+        if scope is None:
+            return
+        fields = {'merkle_root': tree.root()}
+        if scope['months'] is None:
+            fields['merkle_months'] = tree.month_hashes()
+            fields['merkle_days'] = tree.by_month
+        else:
+            month_hashes = tree.month_hashes()
+            for month in scope['months']:
+                fields[f'merkle_months.{month}'] = month_hashes.get(month, DIRTY_HASH)
+            for day in scope['days']:
+                fields[f'merkle_days.{day[:7]}.{day}'] = tree.day_hash(day) or DIRTY_HASH
+        rev = scope['rev']
+        self.collection.update_one(
+            {'username': self.username, 'rev': rev_filter(rev)},
+            {'$set': fields}
+        )
+
+    def pack_days(self, years):
+        """将若干年的计数器 {年份: {日期: {设备: 秒数}}} 打包写入archive，并删除对应的days字段
+
+        以最近一次比较哈希时的版本号为条件，期间有其他设备上传则放弃，返回是否写入。
+        """
+        if self.last_rev is None or not years:
+            return False
+        result = self.collection.update_one(
+            {'username': self.username, 'rev': rev_filter(self.last_rev)},
+            {
+                '$set': dict({f'archive.{year}': Binary(pack_year(days)) for year, days in years.items()},
+                             last_device=self.device_id, last_write=self.write_marker()),
+                '$unset': {f'days.{day}': '' for days in years.values() for day in days}
+            }
+        )
+        return result.matched_count == 1
+
+    def is_own_change(self, change):
+        """本设备的上传或哈希写回引起的变更无需再同步"""
+        fields = change.get('updateDescription', {}).get('updatedFields')
+        if not fields:
+            # 插入和替换事件带有完整文档
+            return change.get('fullDocument', {}).get('last_write') in self.own_writes
+        if fields.get('last_write') in self.own_writes:
+            return True
+        return all(field.startswith('merkle_') for field in fields)
+
+    def ensure_document(self):
+        """新用户还没有云端文档时先创建空文档，返回文档的_id"""
+        self.collection.update_one({'username': self.username}, {'$setOnInsert': {'rev': 0}}, upsert=True)
+        return self.find_fields(['_id']).get('_id')
+
+    def watch(self, on_change, stop_event, on_ready=None):
+        """订阅本用户文档的变更流，其他设备写入时调用on_change()
+
+        变更流按文档_id过滤，订阅前确保文档已存在；变更流打开后调用on_ready()。
+        阻塞直到stop_event被设置；服务器不支持变更流（非副本集）或连接断开时抛出异常。
+        """
+        pipeline = [{'$match': {
+            'operationType': {'$in': ['insert', 'update', 'replace']},
+            'documentKey._id': self.ensure_document()
+        }}]
+        with self.collection.watch(pipeline, max_await_time_ms=self.WATCH_AWAIT_MS) as stream:
+            if on_ready:
+                on_ready()
+            while not stop_event.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is not None and not self.is_own_change(change):
+                    on_change()
+
+    @property
+    def etag(self):
+        return None
+
+
+class HttpTransport:
+    """通过后端REST API同步的传输
+
+    上传的增量使用gzip压缩；下载时携带If-None-Match，
+    云端历史没有变化时后端返回304，不传输任何数据。
+    后端按登录的账户和本地用户名（profile参数）分别保存每个本地用户的历史。
+    """
+
+    CELLS_PATH = '/api/sync/cells'
+    WATCH_PATH = '/api/sync/cells/watch'
+    WATCH_TIMEOUT = 25  # 长轮询在后端最长挂起的秒数
+
+    def __init__(self, connection, username, device_id, etag=None):
+        self.connection = connection
+        self.username = username
+        self.device_id = device_id
+        self.etag = etag
+
+    @staticmethod
+    def revision(etag):
+        """ETag中的同步版本号，没有时返回-1"""
+        return int(etag.strip('"')) if etag else -1
+
+    def push_cells(self, cells):
+        """上传一批计数器 [((日期, 设备), 值)]
+
+        本地已合并到版本N时，上传后的版本恰好为N+1说明期间没有其他设备写入，
+        本地仍与云端一致，沿用新的ETag，下次下载可直接得到304。
+        """
+        payload = json.dumps({'cells': [[day, device, value] for (day, device), value in cells]})
+        response = self.connection.get_client().post(
+            self.connection.url(self.CELLS_PATH),
+            params={'profile': self.username},
+            data=gzip.compress(payload.encode('utf-8')),
+            headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip', 'X-Device-Id': self.device_id},
+            timeout=self.connection.TIMEOUT
+        )
+        response.raise_for_status()
+        etag = response.headers.get('ETag')
+        if self.etag and etag and self.revision(etag) == self.revision(self.etag) + 1:
+            self.etag = etag
+
+    def pull_cells(self):
+        """下载计数器；云端未变化（304）时返回空字典"""
+        headers = {'Accept-Encoding': 'gzip'}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        response = self.connection.get_client().get(
+            self.connection.url(self.CELLS_PATH),
+            params={'profile': self.username},
+            headers=headers,
+            timeout=self.connection.TIMEOUT
+        )
+        if response.status_code == 304:
+            return {}
+        response.raise_for_status()
+        self.etag = response.headers.get('ETag')
+        return response.json().get('cells', {})
+
+    def pull_changed_cells(self, tree):
+        """后端以ETag判断整份历史是否变化，不逐层比较哈希"""
+        return self.pull_cells(), None
+
+    def publish_hashes(self, tree, scope):
+        pass
+
+    def watch(self, on_change, stop_event, on_ready=None):
+        """长轮询后端，其他设备上传后调用on_change()
+
+        第一次长轮询请求成功后调用on_ready()。
+        阻塞直到stop_event被设置（至多再等待一次WATCH_TIMEOUT），请求失败时抛出异常。
+        """
+        revision = self.revision(self.etag)
+        while not stop_event.is_set():
+            response = self.connection.get_client().get(
+                self.connection.url(self.WATCH_PATH),
+                params={'profile': self.username, 'since': revision, 'device': self.device_id,
+                        'timeout': self.WATCH_TIMEOUT},
+                timeout=(self.connection.TIMEOUT[0], self.WATCH_TIMEOUT + self.connection.TIMEOUT[1])
+            )
+            if response.status_code != 204:
+                response.raise_for_status()
+            if on_ready:
+                on_ready()
+                on_ready = None
+            if response.status_code == 204:
+                continue  # 超时内没有变化
+            body = response.json()
+            revision = body.get('revision', revision)
+            if body.get('changed') and not stop_event.is_set():
+                on_change()
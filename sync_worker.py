@@ -0,0 +1,234 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from sync_scheduler import SyncScheduler
+
+
+class SyncWorker:
+    """后台同步线程
+
+    所有云端I/O（上传、同步）都在这一个线程中执行，Tk线程只负责投递通知。
+    数据变化的通知会被合并上传，等待多久以及定期同步的间隔由SyncScheduler
+    根据计时器状态决定；计时器开始、暂停和跨天时立即同步。
+    执行结果以事件字典的形式放入status_queue，由UI线程自行取出处理。
+
+    另有一个订阅线程监听云端变更（MongoDB变更流或后端长轮询），
+    其他设备写入后立即同步；订阅不可用时退回到定期同步。
+    """
+
+    SYNC_INTERVAL = 600           # 未能订阅云端变更时定期完整同步的间隔（秒）
+    WATCHED_SYNC_INTERVAL = 3600  # 订阅生效时兜底同步的间隔（秒）
+    WATCH_RETRY_SECONDS = 60      # 订阅中断或未连接时重试的间隔（秒）
+
+    def __init__(self, cloud_sync, status_queue, running=False):
+        """初始化同步线程
+
+        Args:
+            cloud_sync: CloudSync实例
+            status_queue: 线程安全的队列，用于向UI报告同步状态（事件中带有用户名）
+            running: 计时器当前是否在运行
+        """
+        self.cloud_sync = cloud_sync
+        self.status_queue = status_queue
+        self.commands = queue.Queue()
+        self.scheduler = SyncScheduler(running)
+
+        # 去抖状态，只在工作线程中访问
+        self.latest_data = None
+        self.first_change = None
+        self.last_change = None
+
+        # 云端变更订阅状态
+        self.stopping = threading.Event()
+        self.watching = False
+
+        self.thread = threading.Thread(target=self.run, name="sync-worker", daemon=True)
+        self.thread.start()
+        self.watch_thread = threading.Thread(target=self.watch_loop, name="sync-watch", daemon=True)
+        self.watch_thread.start()
+        
+        # 重连由连接管理器负责，恢复连接后在本线程中回放离线期间的改动
+        self.cloud_sync.connection.add_listener(self.on_connection_state)
+        
+    def on_connection_state(self, state):
+        """连接状态变化回调（可能在任意线程中调用）"""
+        self.commands.put(('connection', state))
+
+    def on_remote_change(self):
+        """云端有其他设备写入（在订阅线程中调用）"""
+        self.commands.put(('remote', None))
+
+    def notify_changed(self, data):
+        """通知数据已变化（可在任意线程调用）"""
+        self.commands.put(('upload', data))
+
+    def notify_transition(self, kind):
+        """通知计时器状态变化（start、pause、rollover），可在任意线程调用"""
+        self.commands.put(('transition', kind))
+
+    def request_sync(self, event='manual_sync'):
+        """请求一次同步，结果以event事件报告
+
+        Returns:
+            Future，完成时为同步后的数据（可在加载数据时等待）
+        """
+        future = Future()
+        self.commands.put(('sync', (event, future)))
+        return future
+
+    def shutdown(self, data=None, timeout=None):
+        """上传最后的数据并停止线程
+
+        Args:
+            data: 退出前最后一次保存的数据
+            timeout: 等待线程结束的最长时间（秒）
+        """
+        self.cloud_sync.connection.remove_listener(self.on_connection_state)
+        self.stopping.set()
+        if data is not None:
+            self.notify_changed(data)
+        self.commands.put(('stop', None))
+        self.thread.join(timeout)
+        print(self.scheduler.summary())
+
+    def report(self, event, ok, data=None, added=None, merged_at=None):
+        """向UI报告一个事件
+
+        Args:
+            added: 同步事件中其他设备新增的时长 {日期: 秒数}，UI需加到当前计时上
+            merged_at: 合并结果写入本地文件的时间（time.monotonic()）
+        """
+        self.status_queue.put({
+            'event': event,
+            'username': self.cloud_sync.username,
+            'ok': ok,
+            'connected': self.cloud_sync.is_connected,
+            'data': data,
+            'added': added or {},
+            'merged_at': merged_at
+        })
+
+    def sync_interval(self):
+        """定期同步的间隔：订阅生效时只需偶尔兜底同步，暂停和空闲时进一步拉长"""
+        base = self.WATCHED_SYNC_INTERVAL if self.watching else self.SYNC_INTERVAL
+        return self.scheduler.sync_interval(base)
+
+    def run(self):
+        """工作线程主循环"""
+        next_sync = time.monotonic() + self.sync_interval()
+
+        while True:
+            now = time.monotonic()
+            if self.latest_data is not None:
+                deadline = self.scheduler.upload_deadline(self.first_change, self.last_change)
+            else:
+                deadline = next_sync
+
+            try:
+                kind, payload = self.commands.get(timeout=max(0, deadline - now))
+            except queue.Empty:
+                kind, payload = None, None
+
+            try:
+                if kind == 'upload':
+                    self.scheduler.on_change(self.latest_data is not None)
+                    self.latest_data = payload
+                    self.last_change = time.monotonic()
+                    if self.first_change is None:
+                        self.first_change = self.last_change
+                    continue
+                if kind == 'stop':
+                    self.flush()
+                    break
+                if kind == 'sync':
+                    event, future = payload
+                    try:
+                        self.flush()
+                        future.set_result(self.sync(event))
+                    except Exception as e:
+                        future.set_exception(e)
+                        raise
+                    finally:
+                        next_sync = time.monotonic() + self.sync_interval()
+                    continue
+                if kind == 'transition':
+                    # 状态变化前后立即上传并同步
+                    self.scheduler.on_transition(payload)
+                    self.flush()
+                    self.sync()
+                    next_sync = time.monotonic() + self.sync_interval()
+                    continue
+                if kind == 'remote':
+                    self.flush()
+                    self.sync('remote_sync')
+                    next_sync = time.monotonic() + self.sync_interval()
+                    continue
+                if kind == 'connection':
+                    self.report('connection', self.cloud_sync.is_connected)
+                    if self.cloud_sync.is_connected:
+                        # 恢复连接后立即回放离线期间的改动
+                        self.flush()
+                        self.sync()
+                        next_sync = time.monotonic() + self.sync_interval()
+                    continue
+
+                now = time.monotonic()
+                if self.latest_data is not None and now >= self.scheduler.upload_deadline(
+                        self.first_change, self.last_change):
+                    self.flush()
+                if now >= next_sync:
+                    self.sync()
+                    next_sync = time.monotonic() + self.sync_interval()
+            except Exception as e:
+                print(f"同步线程出错: {e}")
+
+    def watch_loop(self):
+        """订阅线程主循环：订阅中断后等待一段时间再重新订阅"""
+        reported = False
+        while not self.stopping.is_set():
+            if self.cloud_sync.is_connected:
+                try:
+                    # 订阅真正生效后才拉长兜底同步的间隔
+                    self.cloud_sync.watch_changes(self.on_remote_change, self.stopping, self.on_watch_ready)
+                    reported = False
+                except Exception as e:
+                    if not reported:
+                        print(f"订阅云端变更失败，改为定期同步: {e}")
+                        reported = True
+                finally:
+                    self.watching = False
+            self.stopping.wait(self.WATCH_RETRY_SECONDS)
+
+    def on_watch_ready(self):
+        """云端变更订阅已打开（在订阅线程中调用）"""
+        self.watching = True
+
+    def flush(self):
+        """上传去抖期间累积的最新数据"""
+        if self.latest_data is None:
+            return
+        data = self.latest_data
+        self.latest_data = None
+        self.first_change = None
+        self.last_change = None
+
+        was_connected = self.cloud_sync.is_connected
+        transferred = self.cloud_sync.transfer_bytes
+        ok = self.cloud_sync.upload_data(data)
+        transferred = self.cloud_sync.transfer_bytes - transferred
+        if transferred:
+            self.scheduler.record('upload', transferred)
+        if ok or was_connected:
+            self.report('upload', ok)
+
+    def sync(self, event='sync'):
+        """执行一次完整同步，返回同步后的数据"""
+        transferred = self.cloud_sync.transfer_bytes
+        data = self.cloud_sync.sync_data()
+        if self.cloud_sync.is_connected:
+            self.scheduler.record('sync', self.cloud_sync.transfer_bytes - transferred)
+        self.report(event, self.cloud_sync.is_connected, data,
+                    self.cloud_sync.remote_added, self.cloud_sync.merged_at)
+        return data
@@ -1,132 +1,284 @@
 import json
-import hashlib
 import os
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 import threading
-import time
+import queue
+
+from cloud_connection import ConnectionState, get_connection_manager
+from user_store import UserStore
+from session_token import SessionToken
+from password_hasher import PasswordHasher
+from user_record import UserRecord
+from user_worker import UserWorker
 
 # 尝试导入可选依赖
 try:
-    from dotenv import load_dotenv
-    from pymongo import MongoClient
-    from bson.objectid import ObjectId
-    import pymongo.errors
+    from pymongo import UpdateOne
     MONGODB_AVAILABLE = True
-    
-    # 自定义JSON编码器，处理MongoDB的ObjectId
-    class MongoJSONEncoder(json.JSONEncoder):
-        def default(self, obj):
-            if isinstance(obj, ObjectId):
-                return str(obj)
-            return super().default(obj)
 except ImportError:
     MONGODB_AVAILABLE = False
 
+# 首次同步分页下载用户的批大小
+USER_SYNC_BATCH_SIZE = 500
+
+# 水位线回退的秒数，覆盖水位线附近提交较晚的写入（重复下载是幂等的）
+WATERMARK_OVERLAP_SECONDS = 5
+
 class UserManager:
     def __init__(self):
-        self.users_file = Path('data/users.json')
-        self.auto_login_file = Path('data/auto_login.json')
+        self.users_file = Path('data/users.json')  # 旧版账户文件，首次启动时导入
+        self.users_db_file = Path('data/users.db')
+        self.auto_login_file = Path('data/auto_login.json')  # 旧版自动登录设置，启动时转换为会话令牌
+        self.session = SessionToken(Path('data/session.json'), Path('data/session.key'))
+        self.user_sync_state_file = Path('data/user_sync_state.json')
         self.users_file.parent.mkdir(exist_ok=True)
         self.current_user = None
-        self.is_connected = False  # 云连接状态
+        self.indexes_ready = False
+        self.cloud_started = False
         
-        # 初始化MongoDB连接
-        self.init_cloud_connection()
+        # 密码哈希的代价可通过环境变量PIMER_PASSWORD_COST（scrypt的log2 N）调整
+        self.hasher = PasswordHasher(int(os.getenv('PIMER_PASSWORD_COST', PasswordHasher.DEFAULT_COST)))
         
-        # 加载本地用户数据
+        # 后台登录复核的结果，由UI线程取出处理
+        self.events = queue.Queue()
+        
+        # 使用共享连接（与CloudSync共用同一个MongoClient），连接状态变化时自动同步
+        # 连接在界面显示后由start_cloud在后台建立，本地登录无需等待
+        self.connection = get_connection_manager()
+        self.connection.add_listener(self.on_connection_state)
+        
+        # 加载本地用户数据和增量同步的水位线
         self.load_users()
+        self.load_user_watermark()
+        
+        # 账户记录只由worker的状态线程写入，读者读取self.records快照（写时复制，不加锁）
+        # 用户同步（定期、恢复连接后、按请求）都在worker的同步线程中执行
+        self.records = {}
+        self.worker = UserWorker(self)
         
         # 检查自动登录
         self.check_auto_login()
         
-        # 启动自动同步线程
-        self.start_auto_sync()
+    @property
+    def is_connected(self):
+        """云端连接状态（来自共享连接管理器）"""
+        return self.connection.is_connected
+        
+    @property
+    def users_collection(self):
+        """用户集合，云端不可用时为None"""
+        return self.connection.get_collection('users')
+        
+    def start_cloud(self):
+        """在后台线程中初始化云端连接（界面首次显示后调用，不阻塞启动）"""
+        if self.cloud_started:
+            return
+        self.cloud_started = True
+        threading.Thread(target=self.init_cloud_connection, name="user-cloud-init", daemon=True).start()
         
     def init_cloud_connection(self):
         """初始化云连接"""
         print("初始化MongoDB连接")
-        self.is_connected = False
-        
-        if not MONGODB_AVAILABLE:
-            print("MongoDB依赖不可用")
+        if not self.connection.available:
+            print("云端不可用，使用本地用户管理")
             return
             
-        try:
-            # 加载环境变量
-            load_dotenv()
-            
-            # MongoDB配置
-            self.uri = os.getenv('MONGODB_URI')
-            self.db_name = os.getenv('MONGODB_DB', 'work_timer')
-            self.users_collection_name = 'users'  # 用户集合名称
-            
-            if not self.uri:
-                print("未设置MongoDB URI，使用本地用户管理")
-                return
-                
-            print(f"尝试连接MongoDB: {self.uri[:20]}...")
-            self.client = MongoClient(self.uri, serverSelectionTimeoutMS=5000)
-            self.db = self.client[self.db_name]
-            self.users_collection = self.db[self.users_collection_name]
-            
-            # 测试连接
-            print("测试MongoDB连接...")
-            self.client.admin.command('ping')
+        if self.connection.ensure_connected():
             print("MongoDB用户管理连接成功")
-            self.is_connected = True
+            self.ensure_indexes()
+        else:
+            print("MongoDB用户管理连接失败，使用本地用户管理")
             
-            # 确保用户集合有索引
+    def ensure_indexes(self):
+        """确保用户集合有索引（每个进程只需执行一次）"""
+        if self.indexes_ready:
+            return
+        try:
             self.users_collection.create_index("username", unique=True)
+            self.users_collection.create_index("updated_at")  # 增量同步按修改时间查询
+            self.indexes_ready = True
         except Exception as e:
-            print(f"MongoDB用户管理连接失败: {str(e)}，使用本地用户管理")
-            self.is_connected = False
-    
-    def start_auto_sync(self):
-        """启动自动同步线程"""
-        def auto_sync():
-            while True:
-                try:
-                    # 每30分钟同步一次用户数据
-                    time.sleep(1800)
-                    self.sync_users()
-                except Exception as e:
-                    print(f"自动同步用户数据出错: {e}")
-        
-        # 启动后台线程
-        sync_thread = threading.Thread(target=auto_sync, daemon=True)
-        sync_thread.start()
+            print(f"创建用户索引失败: {e}")
+            self.connection.report_failure(e)
+            
+    def on_connection_state(self, state):
+        """连接状态变化回调：恢复连接后在后台同步用户数据"""
+        if state != ConnectionState.CONNECTED:
+            return
+        def resync():
+            try:
+                self.ensure_indexes()
+                self.refresh_session()
+                self.worker.request_sync()
+            except Exception as e:
+                print(f"恢复连接后同步用户数据失败: {e}")
+        threading.Thread(target=resync, daemon=True).start()
         
     def load_users(self):
-        """加载用户数据"""
+        """打开本地账户存储（按需读取，不把所有账户载入内存）"""
+        self.users = UserStore(self.users_db_file, legacy_file=self.users_file)
+        
+    def get_user(self, username):
+        """读取一个本地账户（只读，不要修改返回的字典）
+        
+        先查快照，快照中没有时从账户存储读取；可在任意线程中调用。
+        """
+        user_data = self.records.get(username)
+        if user_data is None:
+            user_data = self.users.get(username)
+        return user_data
+        
+    def publish(self, records):
+        """发布包含records的新快照（只在状态线程中调用）"""
+        snapshot = dict(self.records)
+        snapshot.update(records)
+        self.records = snapshot
+        
+    def store_users(self, records):
+        """在一个事务中写入多个账户并发布快照（只在状态线程中调用）"""
+        self.users.update(records)
+        self.publish(records)
+        
+    def put_user(self, username, user_data):
+        """保存一个本地账户，等待写入完成"""
+        self.worker.call(self.store_users, {username: user_data})
+            
+    def update_user(self, username, **fields):
+        """更新一个本地账户的若干字段（在状态线程中读改写，不等待完成）
+        
+        Returns:
+            Future，结果为更新后的记录；账户不存在时为None
+        """
+        def apply():
+            user_data = self.get_user(username)
+            if user_data is None:
+                return None
+            user_data = dict(user_data)
+            user_data.update(fields)
+            self.store_users({username: user_data})
+            return user_data
+        return self.worker.post(apply)
+        
+    def read_all_users(self):
+        """从账户存储读取全部账户（只在状态线程中调用）
+
+        只供同步时与云端比较，不发布到快照，快照仍只包含用到过的账户。
+        """
+        return dict(self.users.items())
+        
+    def apply_synced_users(self, cloud_users, force):
+        """采用云端较新或本地没有的账户（只在状态线程中调用）
+        
+        与本地记录的比较在写入前进行，同步期间登录更新的本地记录不会被覆盖。
+        """
+        updates = {}
+        for cloud_user in cloud_users:
+            username = cloud_user.username
+            if not username:
+                continue
+            local_user = self.get_user(username)
+            if (force or local_user is None
+                    or self.login_time(cloud_user.last_login) > self.login_time(local_user.get('last_login'))):
+                updates[username] = cloud_user.to_dict()
+        self.store_users(updates)
+        return len(updates)
+            
+    def load_user_watermark(self):
+        """加载上次同步用户时的服务器时间（水位线），没有时为None"""
+        self.user_watermark = None
         try:
-            with open(self.users_file, 'r') as f:
-                self.users = json.load(f)
+            with open(self.user_sync_state_file, 'r') as f:
+                watermark = json.load(f).get('watermark')
+            if watermark:
+                self.user_watermark = datetime.fromisoformat(watermark)
         except FileNotFoundError:
-            self.users = {}
-            self.save_users()
+            pass
+        except Exception as e:
+            print(f"加载用户同步水位线失败: {e}")
             
-    def save_users(self):
-        """保存用户数据"""
-        # 使用自定义编码器处理MongoDB的ObjectId
-        if MONGODB_AVAILABLE:
-            with open(self.users_file, 'w') as f:
-                json.dump(self.users, f, indent=4, cls=MongoJSONEncoder)
-        else:
-            with open(self.users_file, 'w') as f:
-                json.dump(self.users, f, indent=4)
+    def save_user_watermark(self):
+        """保存用户同步水位线"""
+        try:
+            with open(self.user_sync_state_file, 'w') as f:
+                json.dump({'watermark': self.user_watermark.isoformat() if self.user_watermark else None}, f, indent=4)
+        except Exception as e:
+            print(f"保存用户同步水位线失败: {e}")
+            
+    def server_time(self):
+        """MongoDB服务器的当前时间（水位线使用服务器时间，不受本机时钟影响）"""
+        database = self.users_collection.database
+        try:
+            reply = database.command('hello')
+        except Exception:
+            reply = database.command('isMaster')  # 4.4.2以前的服务器
+        return reply['localTime']
+        
+    def fetch_changed_users(self, full=False):
+        """下载自上次同步以来修改过的云端用户
+        
+        每次写入用户都以$currentDate记录服务器端的updated_at，
+        有水位线时只查询updated_at不早于水位线的用户；
+        首次同步（或full=True）按_id分页遍历整个集合。
+        
+        Returns:
+            (UserRecord列表, 新的水位线)
+        """
+        watermark = self.server_time() - timedelta(seconds=WATERMARK_OVERLAP_SECONDS)
+        
+        if self.user_watermark is not None and not full:
+            users = [UserRecord.from_document(user) for user in
+                     self.users_collection.find({"updated_at": {"$gte": self.user_watermark}},
+                                                UserRecord.projection())]
+            return users, watermark
+            
+        # 分页时需要_id作为游标
+        projection = dict(UserRecord.projection(), _id=1)
+        users = []
+        last_id = None
+        while True:
+            query = {} if last_id is None else {"_id": {"$gt": last_id}}
+            batch = list(self.users_collection.find(query, projection).sort('_id', 1).limit(USER_SYNC_BATCH_SIZE))
+            for user in batch:
+                last_id = user['_id']
+                users.append(UserRecord.from_document(user))
+            if len(batch) < USER_SYNC_BATCH_SIZE:
+                return users, watermark
             
     def hash_password(self, password):
-        """密码加密"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """计算新的密码哈希（加盐scrypt）"""
+        return self.hasher.hash(password)
+        
+    def verify_password(self, password, stored):
+        """验证密码（兼容旧版SHA-256哈希，成功结果短时间缓存）"""
+        return self.hasher.verify(password, stored)
+        
+    def upgraded_password(self, password, stored):
+        """验证通过后，旧版或代价参数已变化的哈希返回按当前参数重新计算的哈希，否则返回原哈希"""
+        if self.hasher.needs_rehash(stored):
+            return self.hash_password(password)
+        return stored
+    
+    @staticmethod
+    def login_time(last_login):
+        """用户最后登录时间，从未登录时视为很早以前"""
+        return datetime.fromisoformat(last_login or '2000-01-01T00:00:00')
     
     def sync_users(self, force=False, progress_callback=None):
-        """同步用户数据到云端
+        """同步用户数据到云端，等待同步线程完成（可在任意线程中调用）
         
         Args:
             force: 是否强制同步所有用户数据，忽略时间戳比较
             progress_callback: 进度回调函数，接收一个0-100的整数表示进度
         """
+        self.worker.request_sync(force, progress_callback).result()
+        
+    def run_sync_users(self, force=False, progress_callback=None):
+        """执行一次用户同步（只在worker的同步线程中调用）
+        
+        一次$in查询取回本地用户在云端的登录时间，一次无序bulk_write批量上传，
+        再按水位线只下载上次同步以来修改过的用户（首次同步分页下载全部）。
+        """
         if not self.is_connected:
             if progress_callback:
                 progress_callback(0)
@@ -136,87 +288,53 @@ class UserManager:
             if progress_callback:
                 progress_callback(10)
                 
-            # 上传本地用户到云端
-            local_users = list(self.users.items())
-            total_users = len(local_users)
+            local_users = {username: UserRecord.from_document(dict(user_data, username=username))
+                           for username, user_data in self.worker.call(self.read_all_users).items()}
+            local_names = list(local_users)
             
-            for i, (username, user_data) in enumerate(local_users):
-                # 创建用户数据的副本，避免修改原始数据
-                user_data_copy = user_data.copy()
-                
-                # 检查云端是否已存在该用户
-                cloud_user = self.users_collection.find_one({"username": username})
-                
-                if not cloud_user:
-                    # 如果云端不存在，则上传
-                    user_data_copy['username'] = username
-                    user_data_copy['last_sync'] = datetime.now().isoformat()
-                    self.users_collection.insert_one(user_data_copy)
-                else:
-                    # 如果云端存在，比较时间戳或强制更新
-                    if force:
-                        should_update = True
-                    else:
-                        local_time = datetime.fromisoformat(user_data.get('last_login', '2000-01-01T00:00:00'))
-                        cloud_time = datetime.fromisoformat(cloud_user.get('last_login', '2000-01-01T00:00:00'))
-                        should_update = local_time > cloud_time
-                        
-                    if should_update:
-                        # 本地数据更新，更新云端
-                        user_data_copy['last_sync'] = datetime.now().isoformat()
-                        # 删除可能存在的_id字段，避免更新时出错
-                        if '_id' in user_data_copy:
-                            del user_data_copy['_id']
-                        self.users_collection.update_one(
-                            {"username": username},
-                            {"$set": user_data_copy}
-                        )
+            # 一次查询只取回本地用户在云端的登录时间，用于决定是否上传
+            cloud_logins = {
+                user['username']: user.get('last_login')
+                for user in self.users_collection.find({"username": {"$in": local_names}},
+                                                       UserRecord.projection('username', 'last_login'))
+            }
+            
+            if progress_callback:
+                progress_callback(30)
                 
-                # 更新进度
-                if progress_callback and total_users > 0:
-                    progress = 10 + int(40 * (i + 1) / total_users)
-                    progress_callback(progress)
+            # 上传：云端不存在的插入，本地更新的覆盖，合并为一次批量写入
+            sync_time = datetime.now().isoformat()
+            operations = []
+            for username in local_names:
+                record = local_users[username]
+                record.last_sync = sync_time
+                if username not in cloud_logins:
+                    # $setOnInsert：其他客户端同时插入时不覆盖
+                    operations.append(UpdateOne({"username": username}, {
+                        "$setOnInsert": record.to_dict(),
+                        "$currentDate": {"updated_at": True}
+                    }, upsert=True))
+                elif force or self.login_time(record.last_login) > self.login_time(cloud_logins[username]):
+                    operations.append(UpdateOne({"username": username}, {
+                        "$set": record.to_dict(),
+                        "$currentDate": {"updated_at": True}
+                    }))
+            if operations:
+                self.users_collection.bulk_write(operations, ordered=False)
             
             if progress_callback:
                 progress_callback(50)
                 
-            # 下载云端用户到本地
-            cloud_users = list(self.users_collection.find({}))
-            total_cloud_users = len(cloud_users)
+            # 下载：只取回上次同步以来修改过的用户，云端较新或本地没有时采用
+            changed_users, watermark = self.fetch_changed_users(full=force)
             
-            for i, cloud_user in enumerate(cloud_users):
-                username = cloud_user.get('username')
-                if username:
-                    # 创建云端用户数据的副本
-                    cloud_user_copy = dict(cloud_user)
-                    
-                    # 删除MongoDB的_id字段
-                    if '_id' in cloud_user_copy:
-                        del cloud_user_copy['_id']
-                    
-                    if username not in self.users:
-                        # 如果本地不存在，则添加
-                        self.users[username] = cloud_user_copy
-                    else:
-                        # 如果本地存在，比较时间戳或强制更新
-                        if force:
-                            should_update = True
-                        else:
-                            local_time = datetime.fromisoformat(self.users[username].get('last_login', '2000-01-01T00:00:00'))
-                            cloud_time = datetime.fromisoformat(cloud_user.get('last_login', '2000-01-01T00:00:00'))
-                            should_update = cloud_time > local_time
-                            
-                        if should_update:
-                            # 云端数据更新，更新本地
-                            self.users[username] = cloud_user_copy
+            if progress_callback:
+                progress_callback(70)
                 
-                # 更新进度
-                if progress_callback and total_cloud_users > 0:
-                    progress = 50 + int(40 * (i + 1) / total_cloud_users)
-                    progress_callback(progress)
-            
-            # 保存本地用户数据
-            self.save_users()
+            # 在一个事务中保存本地用户数据，下载成功后才推进水位线
+            self.worker.call(self.apply_synced_users, changed_users, force)
+            self.user_watermark = watermark
+            self.save_user_watermark()
             
             if progress_callback:
                 progress_callback(100)
@@ -224,7 +342,7 @@ class UserManager:
             print("用户数据同步完成")
         except Exception as e:
             print(f"同步用户数据失败: {e}")
-            self.is_connected = False
+            self.connection.report_failure(e)
             
             if progress_callback:
                 progress_callback(-1)  # 表示同步失败
@@ -232,53 +350,46 @@ class UserManager:
     def register(self, username, password):
         """注册新用户"""
         # 先检查本地是否存在
-        if username in self.users:
+        if self.get_user(username) is not None:
             return False, "用户名已存在"
         
         # 如果连接到云端，检查云端是否存在
         if self.is_connected:
             try:
-                cloud_user = self.users_collection.find_one({"username": username})
+                cloud_user = self.users_collection.find_one({"username": username}, UserRecord.projection())
                 if cloud_user:
                     # 如果云端存在，同步到本地
-                    cloud_user_copy = dict(cloud_user)
-                    if '_id' in cloud_user_copy:
-                        del cloud_user_copy['_id']
-                    self.users[username] = cloud_user_copy
-                    self.save_users()
+                    self.put_user(username, UserRecord.from_document(cloud_user).to_dict())
                     return False, "用户名已存在（云端）"
             except Exception as e:
                 print(f"检查云端用户失败: {e}")
-                self.is_connected = False
+                self.connection.report_failure(e)
         
         # 创建新用户
-        user_data = {
-            'username': username,
-            'password': self.hash_password(password),
-            'created_at': datetime.now().isoformat(),
-            'last_login': None
-        }
+        record = UserRecord(username, password=self.hash_password(password),
+                            created_at=datetime.now().isoformat())
         
         # 保存到本地
-        self.users[username] = user_data
-        self.save_users()
+        self.put_user(username, record.to_dict())
         
         # 如果连接到云端，保存到云端
         if self.is_connected:
             try:
-                user_data_copy = user_data.copy()
-                user_data_copy['last_sync'] = datetime.now().isoformat()
-                self.users_collection.insert_one(user_data_copy)
+                record.last_sync = datetime.now().isoformat()
+                self.users_collection.update_one(
+                    {"username": username},
+                    {"$setOnInsert": record.to_dict(), "$currentDate": {"updated_at": True}},
+                    upsert=True
+                )
             except Exception as e:
                 print(f"保存用户到云端失败: {e}")
-                self.is_connected = False
+                self.connection.report_failure(e)
         
         return True, "注册成功"
         
     def login(self, username, password):
         """用户登录"""
         print(f"尝试登录用户: {username}")
-        print(f"本地用户列表: {list(self.users.keys())}")
         
         # 如果连接到云端，优先从云端验证
         if self.is_connected:
@@ -290,30 +401,26 @@ class UserManager:
                 if self.is_connected:
                     print(f"尝试从云端验证用户: {username}")
                     # 从云端获取用户
-                    cloud_user = self.users_collection.find_one({"username": username})
+                    cloud_user = self.users_collection.find_one({"username": username}, UserRecord.projection())
                     if cloud_user:
                         print(f"云端找到用户: {username}")
+                        record = UserRecord.from_document(cloud_user)
                         # 验证密码
-                        if cloud_user.get('password') == self.hash_password(password):
+                        if self.verify_password(password, record.password):
                             print(f"云端密码验证成功: {username}")
-                            # 登录成功，更新本地用户
-                            cloud_user_copy = dict(cloud_user)
-                            if '_id' in cloud_user_copy:
-                                del cloud_user_copy['_id']
-                            
-                            # 更新登录时间
-                            login_time = datetime.now().isoformat()
-                            cloud_user_copy['last_login'] = login_time
+                            # 登录成功，更新登录时间（旧版哈希同时升级）
+                            record.last_login = datetime.now().isoformat()
+                            record.password = self.upgraded_password(password, record.password)
                             
                             # 更新云端
                             self.users_collection.update_one(
                                 {"username": username},
-                                {"$set": {"last_login": login_time}}
+                                {"$set": {"last_login": record.last_login, "password": record.password},
+                                 "$currentDate": {"updated_at": True}}
                             )
                             
                             # 更新本地
-                            self.users[username] = cloud_user_copy
-                            self.save_users()
+                            self.put_user(username, record.to_dict())
                             
                             # 设置当前用户
                             self.current_user = username
@@ -325,11 +432,12 @@ class UserManager:
                         print(f"云端未找到用户: {username}")
             except Exception as e:
                 print(f"云端登录验证失败: {e}")
-                self.is_connected = False
+                self.connection.report_failure(e)
                 # 失败后尝试本地验证
         
-        # 本地验证
-        if username not in self.users:
+        # 本地验证（按用户名读取一条记录）
+        user_data = self.get_user(username)
+        if user_data is None:
             print(f"本地未找到用户: {username}")
             # 如果本地不存在，但之前尝试云端验证失败，再次尝试同步用户
             if self.is_connected:
@@ -337,16 +445,16 @@ class UserManager:
                     print(f"尝试同步用户数据后再次验证: {username}")
                     # 尝试从云端获取用户
                     self.sync_users()
-                    print(f"同步后本地用户列表: {list(self.users.keys())}")
                     # 再次检查本地是否有该用户
-                    if username in self.users:
+                    user_data = self.get_user(username)
+                    if user_data is not None:
                         print(f"同步后找到用户: {username}")
                         # 如果同步后找到了用户，继续验证
-                        if self.users[username]['password'] == self.hash_password(password):
+                        if self.verify_password(password, user_data['password']):
                             print(f"同步后密码验证成功: {username}")
                             self.current_user = username
-                            self.users[username]['last_login'] = datetime.now().isoformat()
-                            self.save_users()
+                            self.update_user(username, last_login=datetime.now().isoformat(),
+                                             password=self.upgraded_password(password, user_data['password']))
                             return True, "登录成功（同步后验证）"
                         else:
                             print(f"同步后密码验证失败: {username}")
@@ -357,60 +465,143 @@ class UserManager:
             return False, "用户不存在"
             
         # 检查用户数据结构是否包含password字段
-        if 'password' not in self.users[username]:
+        if 'password' not in user_data:
             # 旧数据结构，更新为新结构
-            self.users[username]['password'] = self.hash_password(password)
-            self.save_users()
             self.current_user = username
-            self.users[username]['last_login'] = datetime.now().isoformat()
-            self.save_users()
+            self.update_user(username, password=self.hash_password(password),
+                             last_login=datetime.now().isoformat())
             return True, "登录成功"
             
-        if self.users[username]['password'] != self.hash_password(password):
+        if not self.verify_password(password, user_data['password']):
             print(f"本地密码验证失败: {username}")
             return False, "密码错误"
             
         print(f"本地密码验证成功: {username}")
         self.current_user = username
-        self.users[username]['last_login'] = datetime.now().isoformat()
-        self.save_users()
+        self.update_user(username, last_login=datetime.now().isoformat(),
+                         password=self.upgraded_password(password, user_data['password']))
         return True, "登录成功"
         
+    def login_local(self, username, password):
+        """只用本地账户存储验证登录，不访问云端（立即返回）"""
+        user_data = self.get_user(username)
+        if user_data is None:
+            return False, "用户不存在"
+        stored = user_data.get('password')
+        if stored is not None and not self.verify_password(password, stored):
+            return False, "密码错误"
+            
+        self.current_user = username
+        # 旧数据结构没有password字段时补上，旧版哈希透明地升级为scrypt
+        self.update_user(username, password=self.upgraded_password(password, stored) if stored else self.hash_password(password),
+                         last_login=datetime.now().isoformat())
+        return True, "登录成功"
+        
+    def login_remote(self, username, password):
+        """本地无法验证时连接云端登录（会阻塞，应在后台线程中调用）"""
+        self.connection.ensure_connected()
+        return self.login(username, password)
+        
+    def revalidate_login(self, username, password):
+        """在后台向云端复核本地登录并更新云端的登录时间
+        
+        结果以事件放入self.events：
+        - login_verified：云端验证通过（或云端还没有该账户，已上传）
+        - login_rejected：云端密码已在其他设备上修改，本地记录已更新为云端版本
+        """
+        def revalidate():
+            if not self.connection.ensure_connected():
+                return
+            try:
+                cloud_user = self.users_collection.find_one({"username": username}, UserRecord.projection())
+                # 在状态线程中读取，确保看到登录时提交的更新
+                local_user = self.worker.call(self.get_user, username)
+                if cloud_user is None:
+                    # 仅在本地注册过的账户，补传到云端
+                    if local_user is not None:
+                        self.users_collection.update_one(
+                            {"username": username},
+                            {"$setOnInsert": UserRecord.from_document(local_user).to_dict(),
+                             "$currentDate": {"updated_at": True}},
+                            upsert=True
+                        )
+                    self.events.put({'event': 'login_verified', 'username': username})
+                    return
+                    
+                record = UserRecord.from_document(cloud_user)
+                if not self.verify_password(password, record.password):
+                    self.put_user(username, record.to_dict())
+                    self.events.put({'event': 'login_rejected', 'username': username})
+                else:
+                    fields = {"last_login": (local_user or {}).get('last_login') or datetime.now().isoformat()}
+                    if self.hasher.needs_rehash(record.password):
+                        # 云端仍是旧版哈希，换成本地已升级的哈希
+                        fields["password"] = self.upgraded_password(password, (local_user or {}).get('password'))
+                    self.users_collection.update_one(
+                        {"username": username},
+                        {"$set": fields, "$currentDate": {"updated_at": True}}
+                    )
+                    self.events.put({'event': 'login_verified', 'username': username})
+            except Exception as e:
+                print(f"云端复核登录失败: {e}")
+                self.connection.report_failure(e)
+        threading.Thread(target=revalidate, daemon=True).start()
+        
     def set_auto_login(self, enable=True):
-        """设置自动登录"""
+        """设置自动登录：开启时签发会话令牌，关闭时删除令牌"""
+        if not enable:
+            self.session.clear()
+            return True
         if not self.is_logged_in():
             return False
+        return self.session.issue(self.current_user)
             
+    def check_auto_login(self):
+        """用本地会话令牌恢复上次的登录（只读取令牌文件，不访问账户存储和云端）"""
+        self.migrate_auto_login()
+        username = self.session.restore()
+        if username is None:
+            return False
+        self.current_user = username
+        # 没有云端可以复核时在本地续期，否则由refresh_session在联网后续期
+        if not self.connection.available and self.session.needs_refresh():
+            self.session.issue(username)
+        return True
+        
+    def migrate_auto_login(self):
+        """将旧版auto_login.json转换为会话令牌"""
+        if not self.auto_login_file.exists():
+            return
         try:
-            auto_login_data = {}
-            if enable:
-                auto_login_data = {
-                    'username': self.current_user,
-                    'enabled': True
-                }
-                
-            with open(self.auto_login_file, 'w') as f:
-                json.dump(auto_login_data, f, indent=4)
-            return True
+            with open(self.auto_login_file, 'r') as f:
+                auto_login = json.load(f)
+            if auto_login.get('enabled') and self.get_user(auto_login.get('username')) is not None:
+                self.session.issue(auto_login['username'])
+            self.auto_login_file.unlink()
         except Exception as e:
-            print(f"设置自动登录失败: {e}")
-            return False
+            print(f"转换自动登录设置失败: {e}")
             
-    def check_auto_login(self):
-        """检查是否有自动登录设置"""
+    def refresh_session(self):
+        """云端可用时续期会话令牌，并记录这次自动登录的时间
+        
+        只在云端仍存在该账户时续期；账户已被删除时令牌到期后需要重新输入密码。
+        """
+        username = self.session.restore()
+        if username is None or username != self.current_user:
+            return
         try:
-            if self.auto_login_file.exists():
-                with open(self.auto_login_file, 'r') as f:
-                    auto_login = json.load(f)
-                    
-                if auto_login.get('enabled') and auto_login.get('username') in self.users:
-                    self.current_user = auto_login.get('username')
-                    self.users[self.current_user]['last_login'] = datetime.now().isoformat()
-                    self.save_users()
-                    return True
+            login_time = datetime.now().isoformat()
+            result = self.users_collection.update_one(
+                {"username": username},
+                {"$set": {"last_login": login_time}, "$currentDate": {"updated_at": True}}
+            )
+            if result.matched_count:
+                self.session.issue(username)
+                if self.get_user(username) is not None:
+                    self.update_user(username, last_login=login_time)
         except Exception as e:
-            print(f"检查自动登录失败: {e}")
-        return False
+            print(f"续期会话令牌失败: {e}")
+            self.connection.report_failure(e)
         
     def get_user_data_file(self, username):
         """获取用户数据文件路径"""
@@ -422,6 +613,10 @@ class UserManager:
         user_dir.mkdir(parents=True, exist_ok=True)
         return user_dir
         
+    def get_user_backup_dir(self, username):
+        """获取用户的备份目录（每个用户独立的命名空间）"""
+        return Path(f'data/users/{username}/backups')
+        
     def is_logged_in(self):
         """检查是否已登录"""
         return self.current_user is not None
@@ -437,12 +632,10 @@ class UserManager:
         self.set_auto_login(False)
         
     def close(self):
-        """关闭MongoDB连接"""
-        if hasattr(self, 'client') and self.is_connected:
-            try:
-                self.client.close()
-            except:
-                pass
+        """停止用户数据线程并关闭共享的MongoDB连接"""
+        self.connection.remove_listener(self.on_connection_state)
+        self.worker.shutdown(timeout=1)
+        self.connection.close()
 
     def get_cloud_user(self, username):
         """从云端获取指定用户名的用户数据
@@ -455,45 +648,38 @@ class UserManager:
         """
         print(f"尝试从云端获取用户: {username}")
         
-        # 检查MongoDB是否可用
-        if not MONGODB_AVAILABLE:
-            print("MongoDB依赖不可用")
+        # 检查云端是否可用
+        if not self.connection.available:
+            print("云端不可用")
             return None
             
         # 检查连接状态
-        if not hasattr(self, 'is_connected') or not self.is_connected:
+        if not self.is_connected:
             print("MongoDB未连接")
             # 尝试初始化连接
             self.init_cloud_connection()
             
-        if not hasattr(self, 'is_connected') or not self.is_connected:
+        if not self.is_connected:
             print("MongoDB连接失败")
             return None
             
         try:
-            # 确保有users_collection属性
-            if not hasattr(self, 'users_collection'):
+            # 确保有users_collection
+            if self.users_collection is None:
                 print("MongoDB集合未初始化")
                 return None
                 
-            # 从云端获取用户
+            # 从云端获取用户（只下载账户字段）
             print(f"执行MongoDB查询: {username}")
-            cloud_user = self.users_collection.find_one({"username": username})
+            cloud_user = self.users_collection.find_one({"username": username}, UserRecord.projection())
             
             if cloud_user:
                 print(f"MongoDB查询成功，找到用户: {username}")
-                # 创建云端用户数据的副本
-                cloud_user_copy = dict(cloud_user)
-                
-                # 删除MongoDB的_id字段
-                if '_id' in cloud_user_copy:
-                    del cloud_user_copy['_id']
-                    
-                return cloud_user_copy
+                return UserRecord.from_document(cloud_user).to_dict()
             else:
                 print(f"MongoDB查询成功，但未找到用户: {username}")
                 return None
         except Exception as e:
             print(f"从云端获取用户数据失败: {str(e)}")
-            self.is_connected = False
+            self.connection.report_failure(e)
             return None 
\ No newline at end of file
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from pathlib import Path
+
+from cloud_sync import CloudSync
+from history_log import HistoryLog
+from sync_worker import SyncWorker
+
+
+class UserProfile:
+    """一个用户的运行时状态：数据文件、保存日志、云同步和同步线程
+
+    切换到其他用户时不释放，只通知同步线程计时已暂停，
+    调度器会随之拉长同步间隔；切换回来时无需重新连接或重建线程。
+    """
+
+    def __init__(self, username, device_id, status_queue):
+        """创建用户状态（会连接云端，应在后台线程中调用）
+
+        Args:
+            username: 用户名
+            device_id: 本设备ID
+            status_queue: 同步线程向UI报告事件的队列（各用户共用，事件中带有用户名）
+        """
+        self.username = username
+        self.user_dir = Path(f'data/users/{username}')
+        self.user_dir.mkdir(parents=True, exist_ok=True)
+        self.data_file = self.user_dir / 'work_time.json'
+        self.history_log = HistoryLog(self.user_dir)
+        self.cloud_sync = CloudSync(username, device_id, self.history_log)
+        self.sync_worker = SyncWorker(self.cloud_sync, status_queue)
+
+    def deactivate(self):
+        """切换到其他用户：同步线程按暂停状态调度"""
+        self.sync_worker.notify_transition('pause')
+
+    def close(self, data=None, timeout=None):
+        """上传最后的数据并停止同步线程"""
+        self.sync_worker.shutdown(data, timeout=timeout)
+        self.cloud_sync.close()
+
+
+class ProfileCache:
+    """最近使用的用户状态（LRU）
+
+    多人共用一台电脑时，切换回最近使用过的用户直接复用其状态，
+    超出容量时关闭最久未使用的用户，线程和连接数量不随切换次数增长。
+    所有用户共用连接管理器中的同一个云端连接。
+    """
+
+    DEFAULT_CAPACITY = 3
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.profiles = OrderedDict()
+
+    def __contains__(self, username):
+        return username in self.profiles
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def get(self, username, factory, timeout=None):
+        """取出用户状态，不存在时用factory()创建，并关闭超出容量的最久未使用的用户
+
+        Returns:
+            (UserProfile, 是否为已缓存的状态)
+        """
+        profile = self.profiles.get(username)
+        warm = profile is not None
+        if warm:
+            self.profiles.move_to_end(username)
+        else:
+            profile = factory()
+            self.profiles[username] = profile
+        while len(self.profiles) > self.capacity:
+            _, evicted = self.profiles.popitem(last=False)
+            try:
+                evicted.close(timeout=timeout)
+            except Exception as e:
+                print(f"关闭用户状态失败: {e}")
+        return profile, warm
+
+    def discard(self, username, timeout=None):
+        """关闭并移除一个用户的状态（例如云端拒绝了该用户的登录）"""
+        profile = self.profiles.pop(username, None)
+        if profile is not None:
+            profile.close(timeout=timeout)
+
+    def inactive(self, active_username=None):
+        """除当前用户外的所有缓存状态"""
+        return [profile for username, profile in self.profiles.items() if username != active_username]
@@ -0,0 +1,38 @@
+class UserRecord:
+    """账户记录
+
+    只包含账户本身的字段。从云端读取时按操作需要的字段做投影，
+    文档中的其他字段（_id、updated_at、工作记录等）既不下载也不复制。
+    """
+
+    FIELDS = ('username', 'password', 'created_at', 'last_login', 'last_sync')
+    __slots__ = FIELDS
+
+    def __init__(self, username, password=None, created_at=None, last_login=None, last_sync=None):
+        self.username = username
+        self.password = password
+        self.created_at = created_at
+        self.last_login = last_login
+        self.last_sync = last_sync
+
+    @classmethod
+    def projection(cls, *fields):
+        """MongoDB投影：只返回指定字段，不指定时返回全部账户字段"""
+        projection = {'_id': 0}
+        for field in fields or cls.FIELDS:
+            projection[field] = 1
+        return projection
+
+    @classmethod
+    def from_document(cls, document):
+        """从云端文档或本地记录创建，只读取账户字段"""
+        return cls(**{field: document[field] for field in cls.FIELDS if field in document})
+
+    def to_dict(self):
+        """转换为本地存储和上传使用的字典（省略没有值的字段，上传时不会覆盖云端已有的值）"""
+        record = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                record[field] = value
+        return record
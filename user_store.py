@@ -0,0 +1,105 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class UserStore:
+    """本地账户存储（SQLite）
+
+    以用户名为主键，按用户名查找走主键索引，登录和注册只读写一条记录，
+    启动时也无需把所有账户读入内存。提供与字典相同的常用接口
+    （in、[]、get、keys、items、update），注意取出的记录是副本，
+    修改后需要重新赋值才会保存。
+    """
+
+    def __init__(self, db_path, legacy_file=None):
+        """打开账户存储
+
+        Args:
+            db_path: SQLite数据库文件路径
+            legacy_file: 旧版users.json，存储为空时从中导入一次
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        # 同步线程和UI线程共用一个连接，由self.lock串行化
+        self.db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, data TEXT NOT NULL)"
+            )
+        if legacy_file is not None:
+            self.migrate(Path(legacy_file))
+
+    def migrate(self, legacy_file):
+        """从旧版users.json导入账户，导入后将其重命名保留"""
+        if not legacy_file.exists() or len(self):
+            return
+        try:
+            with open(legacy_file, 'r') as f:
+                users = json.load(f)
+            self.update(users)
+            legacy_file.rename(legacy_file.with_name(legacy_file.name + '.migrated'))
+            print(f"已将{len(users)}个账户导入本地账户存储")
+        except Exception as e:
+            print(f"导入旧版用户数据失败: {e}")
+
+    @staticmethod
+    def encode(record):
+        # default=str处理云端记录中的ObjectId等类型
+        return json.dumps(record, ensure_ascii=False, default=str)
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def __getitem__(self, username):
+        record = self.get(username)
+        if record is None:
+            raise KeyError(username)
+        return record
+
+    def get(self, username, default=None):
+        """按用户名读取一条记录"""
+        with self.lock:
+            row = self.db.execute("SELECT data FROM users WHERE username = ?", (username,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def __setitem__(self, username, record):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO users (username, data) VALUES (?, ?)",
+                            (username, self.encode(record)))
+
+    def __delitem__(self, username):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM users WHERE username = ?", (username,))
+
+    def update(self, records):
+        """在一个事务中写入多条记录 {用户名: 记录}"""
+        if not records:
+            return
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO users (username, data) VALUES (?, ?)",
+                                [(username, self.encode(record)) for username, record in records.items()])
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def keys(self):
+        """所有用户名（只读取主键）"""
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT username FROM users ORDER BY username")]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        """所有 (用户名, 记录)"""
+        with self.lock:
+            rows = self.db.execute("SELECT username, data FROM users ORDER BY username").fetchall()
+        return [(username, json.loads(data)) for username, data in rows]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
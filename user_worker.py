@@ -0,0 +1,111 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class UserWorker:
+    """UserManager可变状态的唯一所有者
+
+    账户存储的所有写入（登录时间、密码升级、注册、同步下载的记录）都作为命令
+    排队到状态线程中依次执行，写入后以写时复制的方式发布新的只读快照，
+    读者直接读取快照，不需要加锁，也不会读到写了一半的状态。
+
+    云端用户同步在单独的同步线程中执行（定期、恢复连接后或按请求），
+    同一时间只有一次同步在运行，重复的请求会合并；同步过程中的本地写入
+    同样交给状态线程，因此同步和登录可以并发进行而不会互相覆盖。
+    """
+
+    SYNC_INTERVAL = 1800  # 定期同步用户数据的间隔（秒）
+
+    def __init__(self, manager):
+        """启动状态线程和同步线程
+
+        Args:
+            manager: UserManager实例，同步线程调用其run_sync_users
+        """
+        self.manager = manager
+        self.commands = queue.Queue()
+        self.sync_requests = queue.Queue()
+        self.pending_sync = None
+        self.pending_lock = threading.Lock()
+        self.stopping = threading.Event()
+
+        self.thread = threading.Thread(target=self.run, name="user-state", daemon=True)
+        self.thread.start()
+        self.sync_thread = threading.Thread(target=self.sync_loop, name="user-sync", daemon=True)
+        self.sync_thread.start()
+
+    def in_state_thread(self):
+        return threading.current_thread() is self.thread
+
+    def post(self, func, *args):
+        """在状态线程中执行func(*args)，立即返回Future"""
+        future = Future()
+        if self.in_state_thread():
+            self.execute(func, args, future)
+        else:
+            self.commands.put((func, args, future))
+        return future
+
+    def call(self, func, *args):
+        """在状态线程中执行func(*args)并等待结果
+
+        排在之前提交的写入之后执行，可用作读取自己刚提交的写入的屏障。
+        """
+        return self.post(func, *args).result()
+
+    @staticmethod
+    def execute(func, args, future):
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            print(f"用户数据任务失败: {e}")
+            future.set_exception(e)
+
+    def run(self):
+        """状态线程主循环"""
+        while True:
+            func, args, future = self.commands.get()
+            if func is None:
+                break
+            self.execute(func, args, future)
+
+    def request_sync(self, force=False, progress_callback=None):
+        """请求一次用户同步，返回Future
+
+        尚未开始的普通同步请求会被合并；强制同步和带进度回调的同步单独执行。
+        """
+        if threading.current_thread() is self.sync_thread:
+            future = Future()
+            self.execute(self.manager.run_sync_users, (force, progress_callback), future)
+            return future
+        if force or progress_callback:
+            future = Future()
+            self.sync_requests.put((force, progress_callback, future))
+            return future
+        with self.pending_lock:
+            if self.pending_sync is None:
+                self.pending_sync = Future()
+                self.sync_requests.put((False, None, self.pending_sync))
+            return self.pending_sync
+
+    def sync_loop(self):
+        """同步线程主循环：按请求同步，空闲SYNC_INTERVAL秒后定期同步"""
+        while not self.stopping.is_set():
+            try:
+                force, progress_callback, future = self.sync_requests.get(timeout=self.SYNC_INTERVAL)
+            except queue.Empty:
+                force, progress_callback, future = False, None, Future()
+            if future is None:
+                break
+            with self.pending_lock:
+                if future is self.pending_sync:
+                    self.pending_sync = None
+            self.execute(self.manager.run_sync_users, (force, progress_callback), future)
+
+    def shutdown(self, timeout=None):
+        """停止两个线程（正在进行的云端同步不等待）"""
+        self.stopping.set()
+        self.sync_requests.put((False, None, None))
+        self.commands.put((None, (), None))
+        self.thread.join(timeout)
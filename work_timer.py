@@ -12,6 +12,7 @@ import calendar
 from PIL import Image, ImageTk, ImageDraw, ImageFont
 import pystray
 import threading
+import queue
 import keyboard
 from pathlib import Path
 import shutil
@@ -21,7 +22,11 @@ from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from user_manager import UserManager
 from login_window import LoginWindow
-from cloud_sync import CloudSync
+from shutdown_coordinator import ShutdownCoordinator
+from backup_manager import BackupManager, RetentionPolicy, DEFAULT_QUOTA_MB
+from history_log import HistoryLog
+from user_profile import ProfileCache, UserProfile
+from cloud_connection import ConnectionState, get_connection_manager
 import winsound  # 添加音效支持
 try:
     from playsound import playsound  # 添加更多音效支持
@@ -90,6 +95,8 @@ class Settings:
             'always_on_top': False,  # 默认不置顶
             'theme': 'dark',  # 默认使用深色主题
             'timer_mode': 'up',  # 默认使用正计时模式，'up'为正计时，'down'为倒计时
+            'backup_retention': dict(RetentionPolicy.DEFAULTS),  # 备份保留策略（每层保留的桶数）
+            'backup_quota_mb': DEFAULT_QUOTA_MB,  # 每个用户备份占用空间上限（MB）
             'hotkeys': {
                 'toggle_timer': 'ctrl+shift+space',
                 'show_hide': 'ctrl+shift+h'
@@ -141,6 +148,12 @@ class WorkTimer:
         'progress_fg': '#007aff'
     }
     
+    # 退出时所有收尾步骤的总时限（秒）
+    SHUTDOWN_DEADLINE = 3.0
+    
+    # 加载数据时等待同步线程完成首次同步的时限（秒），超时后先使用本地数据
+    LOAD_SYNC_TIMEOUT = 30.0
+    
     def __init__(self):
         self.settings = Settings()
         self.user_manager = UserManager()
@@ -150,6 +163,16 @@ class WorkTimer:
         # 初始化音效管理器
         self.sound_manager = SoundManager()
         
+        # 同步线程向UI报告状态的队列，由update_timer在UI线程中处理
+        self.sync_events = queue.Queue()
+        
+        # 最近使用的用户状态（云同步、同步线程），切换用户时直接复用
+        self.profiles = ProfileCache()
+        self.ui_ready = False
+        
+        # 云端连接状态变化时推送到状态栏，无需轮询
+        get_connection_manager().add_listener(self.on_connection_state)
+        
         # 立即隐藏主窗口，防止出现半透明白色窗口
         self.root.withdraw()
         
@@ -181,6 +204,9 @@ class WorkTimer:
         # 设置文件路径（提前设置，避免备份时的错误）
         self.setup_file_paths()
         
+        # 界面显示后再在后台连接云端，离线时启动不必等待连接超时
+        self.root.after_idle(self.user_manager.start_cloud)
+        
         # 显示登录窗口或直接加载数据
         if not self.user_manager.is_logged_in():
             self.show_login_window()
@@ -206,21 +232,27 @@ class WorkTimer:
         # 使用线程执行耗时操作，避免界面卡死
         def load_app():
             try:
-                # 重新设置文件路径（确保使用正确的用户目录）
-                self.setup_file_paths()
-                
-                # 初始化云同步
+                # 切换到当前用户的文件路径和云同步（最近使用过的用户直接复用）
+                warm = False
                 if self.user_manager.is_logged_in():
-                    username = self.user_manager.get_current_user()
-                    self.cloud_sync = CloudSync(username)
-                    print(f"云同步已初始化，状态：{'已连接' if self.cloud_sync.is_connected else '未连接'}")
+                    warm = self.activate_profile(self.user_manager.get_current_user())
+                else:
+                    self.setup_file_paths()
                 
-                # 加载数据
-                self.load_data()
+                # 加载数据（缓存中的用户由其同步线程保持最新，直接读取本地文件）
+                self.load_data(use_cloud=not warm)
+                if hasattr(self, 'sync_worker') and self.is_running:
+                    # 恢复了运行中的计时，同步调度按计时状态进行
+                    self.sync_worker.notify_transition('start')
                 
-                # 设置UI和热键
-                self.setup_ui()
-                self.setup_hotkeys()
+                # 界面和热键只在首次登录时创建，切换用户时只刷新计时状态
+                first_login = not self.ui_ready
+                if first_login:
+                    self.setup_ui()
+                    self.setup_hotkeys()
+                    self.ui_ready = True
+                else:
+                    self.refresh_timer_controls()
                 
                 # 标记加载完成
                 self.loading_completed = True
@@ -232,8 +264,9 @@ class WorkTimer:
                 # 显示主窗口
                 self.root.deiconify()
                 
-                # 开始更新计时器
-                self.update_timer()
+                # 开始更新计时器（切换用户时计时循环已在运行）
+                if first_login:
+                    self.update_timer()
             except Exception as e:
                 # 标记加载完成（虽然是出错完成）
                 self.loading_completed = True
@@ -314,17 +347,62 @@ class WorkTimer:
             self.loading_window.iconbitmap(icon_path)
     
 
+    def activate_profile(self, username):
+        """切换到用户的运行时状态，返回是否复用了缓存中的状态"""
+        # 每台设备有独立的ID，云端按设备分别记录工作时长
+        if not hasattr(self, 'cloud_config'):
+            self.cloud_config = CloudConfig()
+            self.cloud_config.setup_device_id()
+        device_id = self.cloud_config.get('device_id')
+        
+        profile, warm = self.profiles.get(
+            username, lambda: UserProfile(username, device_id, self.sync_events),
+            timeout=self.SHUTDOWN_DEADLINE
+        )
+        self.profile = profile
+        self.data_file = profile.data_file
+        self.history_log = profile.history_log
+        self.cloud_sync = profile.cloud_sync
+        self.sync_worker = profile.sync_worker
+        if not warm:
+            print(f"云同步已初始化，状态：{'已连接' if self.cloud_sync.is_connected else '未连接'}")
+        return warm
+        
+    def refresh_timer_controls(self):
+        """切换用户后按该用户的计时状态刷新按钮、时间和进度（不重建界面）"""
+        for name in ('last_hour', 'last_remaining_hour', 'target_completed', 'countdown_completed', 'last_save_time'):
+            if hasattr(self, name):
+                delattr(self, name)
+        self.toggle_button.configure(text=self.icons['pause'] if self.is_running else self.icons['play'])
+        self.update_status()
+        
+        total_seconds = self.accumulated_time
+        if self.settings.get('timer_mode') != 'up':
+            try:
+                total_seconds = max(0, float(self.target_time_var.get()) * 3600 - total_seconds)
+            except ValueError:
+                pass
+        hours = int(total_seconds // 3600)
+        minutes = int((total_seconds % 3600) // 60)
+        seconds = int(total_seconds % 60)
+        self.time_label.configure(text=f"{hours:02d}:{minutes:02d}:{seconds:02d}")
+        self.update_progress(self.accumulated_time)
+
     def setup_file_paths(self):
         """设置文件路径"""
         if self.user_manager.is_logged_in():
             username = self.user_manager.get_current_user()
             self.user_manager.ensure_user_data_dir(username)
             self.data_file = self.user_manager.get_user_data_file(username)
+            self.history_log = HistoryLog(self.data_file.parent)
         else:
             # 默认数据文件路径
             self.data_file = Path('data/work_time.json')
             # 确保目录存在
             self.data_file.parent.mkdir(exist_ok=True)
+            # 未登录时不记录保存日志
+            if hasattr(self, 'history_log'):
+                delattr(self, 'history_log')
             
     def setup_file_watcher(self):
         """设置文件监听"""
@@ -487,12 +565,22 @@ class WorkTimer:
         # 每秒更新一次
         self.root.after(1000, self.update_display)
 
-    def load_data(self):
-        """加载数据（优先从云端同步）"""
+    def load_data(self, use_cloud=True):
+        """加载数据（优先从云端同步）
+        
+        Args:
+            use_cloud: 是否先同步云端数据；为False时只读取本地文件
+        """
         try:
-            if hasattr(self, 'cloud_sync') and self.cloud_sync.is_connected:
-                # 尝试从云端同步数据
-                cloud_data = self.cloud_sync.sync_data()
+            if use_cloud and hasattr(self, 'sync_worker') and self.cloud_sync.is_connected:
+                # 由同步线程执行首次同步（不与其上传并发访问同步状态），在加载线程中等待结果
+                try:
+                    cloud_data = self.sync_worker.request_sync('sync').result(timeout=self.LOAD_SYNC_TIMEOUT)
+                except Exception as e:
+                    # 超时后同步仍会完成，其他设备的时长随同步事件加到计时上
+                    print(f"首次同步失败，使用本地数据: {e}")
+                    cloud_data = None
+                self.data_loaded_at = time.monotonic()
                 if cloud_data:
                     current_date = datetime.now().date()
                     
@@ -521,16 +609,14 @@ class WorkTimer:
                                 self.start_time = None
                                 self.is_running = False
                     
-                    # 设置当前日期
+                    # 设置当前日期（合并结果已由sync_data保存到本地并写入保存日志）
                     self.today = current_date
-                    
-                    # 将云端数据保存到本地
-                    with open(self.data_file, 'w') as f:
-                        json.dump(cloud_data, f, indent=4)
                     return
             
             # 如果没有云端数据或云同步失败，使用本地数据
             try:
+                # 此前写入的合并结果已包含在文件中，process_sync_events不再重复累加
+                self.data_loaded_at = time.monotonic()
                 with open(self.data_file, 'r') as f:
                     data = json.load(f)
                     current_date = datetime.now().date()
@@ -583,6 +669,34 @@ class WorkTimer:
         if hasattr(self, 'time_label'):
             self.update_display()
         
+    def save_local_data(self):
+        """只将当前状态写入本地数据文件，返回完整数据"""
+        # 读取现有数据
+        try:
+            with open(self.data_file, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+            
+        # 更新当天的数据
+        data[str(self.today)] = {
+            'accumulated_time': self.accumulated_time,
+            'is_running': self.is_running,
+            'start_time': self.start_time if self.start_time else None
+        }
+        
+        # 保存所有数据
+        with open(self.data_file, 'w') as f:
+            json.dump(data, f, indent=4)
+            
+        # 追加到保存日志，用于按时间点恢复
+        if hasattr(self, 'history_log'):
+            try:
+                self.history_log.append(str(self.today), data[str(self.today)], data)
+            except Exception as e:
+                print(f"写入保存日志失败: {e}")
+        return data
+        
     def save_data(self):
         """保存数据（同时保存到本地和云端）"""
         if hasattr(self, 'is_saving') and self.is_saving:
@@ -590,47 +704,11 @@ class WorkTimer:
             
         self.is_saving = True
         try:
-            # 读取现有数据
-            try:
-                with open(self.data_file, 'r') as f:
-                    data = json.load(f)
-            except FileNotFoundError:
-                data = {}
-                
-            # 更新当天的数据
-            data[str(self.today)] = {
-                'accumulated_time': self.accumulated_time,
-                'is_running': self.is_running,
-                'start_time': self.start_time if self.start_time else None
-            }
-            
-            # 保存所有数据
-            with open(self.data_file, 'w') as f:
-                json.dump(data, f, indent=4)
-                
-            # 同步到云端
-            if hasattr(self, 'cloud_sync'):
-                # 如果未连接，尝试重新连接
-                if not self.cloud_sync.is_connected and hasattr(self.cloud_sync, 'client'):
-                    try:
-                        self.cloud_sync.client.admin.command('ping')
-                        self.cloud_sync.is_connected = True
-                        print("MongoDB重新连接成功")
-                        # 连接成功后立即更新状态栏
-                        self.update_status_bar()
-                    except Exception as e:
-                        print(f"MongoDB重新连接失败: {e}")
+            data = self.save_local_data()
                 
-                # 如果已连接，上传数据
-                if self.cloud_sync.is_connected:
-                    try:
-                        self.cloud_sync.upload_data(data)
-                        print("数据已上传到云端")
-                    except Exception as e:
-                        print(f"上传数据到云端失败: {e}")
-                        self.cloud_sync.is_connected = False
-                        # 连接失败后立即更新状态栏
-                        self.update_status_bar()
+            # 通知同步线程上传，云端I/O不在UI线程中执行
+            if hasattr(self, 'sync_worker'):
+                self.sync_worker.notify_changed(data)
                 
         finally:
             self.is_saving = False
@@ -717,6 +795,8 @@ class WorkTimer:
             if self.start_time:
                 self.accumulated_time += time.time() - self.start_time
                 self.save_data()
+            if hasattr(self, 'sync_worker'):
+                self.sync_worker.notify_transition('pause')
         else:
             # 获取计时模式
             timer_mode = self.settings.get('timer_mode')
@@ -751,6 +831,8 @@ class WorkTimer:
             self.toggle_button.configure(text=self.icons['pause'])
             self.status_label.configure(text="Working...")
             self.start_time = time.time()
+            if hasattr(self, 'sync_worker'):
+                self.sync_worker.notify_transition('start')
         # 更新进度条
         self.update_progress()
         
@@ -1753,28 +1835,19 @@ class WorkTimer:
         return f"{hours}小时{minutes}分钟"
         
     def backup_data(self):
-        """备份数据文件"""
+        """备份数据文件到当前用户的备份目录（按GFS保留策略和配额剪枝旧备份）"""
         try:
-            # 创建备份目录
-            backup_dir = Path('backups')
-            backup_dir.mkdir(exist_ok=True)
-            
-            # 生成备份文件名（使用时间戳）
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_file = backup_dir / f'work_time_{timestamp}.json'
-            
-            # 复制数据文件
-            if self.data_file.exists():
-                with open(self.data_file, 'r') as src, open(backup_file, 'w') as dst:
-                    data = json.load(src)
-                    json.dump(data, dst, indent=4)
-                    
-                # 清理旧备份（保留最近30个备份）
-                backup_files = sorted(backup_dir.glob('work_time_*.json'))
-                if len(backup_files) > 30:
-                    for old_file in backup_files[:-30]:
-                        old_file.unlink()
-                        
+            # 每个用户的备份存放在各自的数据目录下，互不影响
+            if self.user_manager.is_logged_in():
+                backup_dir = self.user_manager.get_user_backup_dir(self.user_manager.get_current_user())
+            else:
+                backup_dir = self.data_file.parent / 'backups'
+                
+            if not hasattr(self, 'backup_manager') or self.backup_manager.backup_dir != backup_dir:
+                policy = RetentionPolicy.from_config(self.settings.get('backup_retention'))
+                quota_bytes = self.settings.get('backup_quota_mb') * 1024 * 1024
+                self.backup_manager = BackupManager(backup_dir, policy, quota_bytes)
+            self.backup_manager.create_snapshot(self.data_file)
         except Exception as e:
             print(f"备份数据时出错：{e}")
 
@@ -1827,24 +1900,61 @@ class WorkTimer:
             self.quit_app()
 
     def quit_app(self):
-        """退出应用"""
+        """退出应用
+
+        先同步写入最小的本地状态，再由退出协调器并行执行云端上传、备份
+        和停止文件监听，整体耗时不超过SHUTDOWN_DEADLINE秒；最后在本线程中停止托盘图标。
+        """
         try:
-            # 保存当前状态
+            # 停止计时（不经过toggle_timer，避免在退出时触发云端上传）
             if hasattr(self, 'is_running') and self.is_running:
-                self.toggle_timer()
+                self.is_running = False
+                if self.start_time:
+                    self.accumulated_time += time.time() - self.start_time
+                    self.start_time = None
+                    
+            # 先持久化最小状态：只写本地文件
+            data = None
+            if hasattr(self, 'data_file') and hasattr(self, 'today'):
+                try:
+                    data = self.save_local_data()
+                except Exception as e:
+                    print(f"退出时保存本地数据失败: {e}")
+            
+            coordinator = ShutdownCoordinator(deadline=self.SHUTDOWN_DEADLINE)
+            
+            # 由同步线程上传最后的数据后停止
+            if hasattr(self, 'sync_worker'):
+                coordinator.add_step('cloud_upload', self.sync_worker.shutdown, data)
+                
+            # 停止缓存中其他用户的同步线程
+            if hasattr(self, 'profiles') and len(self.profiles):
+                coordinator.add_step('inactive_profiles', self.close_inactive_profiles)
                 
             # 备份数据
             if hasattr(self, 'data_file'):
-                self.backup_data()
+                coordinator.add_step('backup', self.backup_data)
                 
             # 停止文件监听器
             if hasattr(self, 'observer'):
-                self.observer.stop()
-                self.observer.join()
+                def stop_observer():
+                    self.observer.stop()
+                    self.observer.join()
+                coordinator.add_step('file_watcher', stop_observer)
+            
+            report = coordinator.run()
+            print(f"退出步骤完成: {report['completed']}，耗时{report['elapsed']:.2f}秒")
+            for name, error in report['failed'].items():
+                print(f"退出步骤失败: {name}: {error}")
+            if report['timed_out']:
+                print(f"退出步骤超时被截断: {report['timed_out']}")
                 
-            # 停止托盘图标
+            # 停止托盘图标（开销很小；部分后端不支持在其他线程中停止，也不能被时限截断）
             if hasattr(self, 'tray_icon'):
-                self.tray_icon.stop()
+                try:
+                    self.tray_icon.stop()
+                except Exception as e:
+                    print(f"停止托盘图标失败: {e}")
                 
             # 退出主窗口
             self.root.quit()
@@ -2009,23 +2119,35 @@ class WorkTimer:
         if not is_target_completed:
             celebration.after(5000, celebration.destroy)
 
-    def handle_logout(self):
-        """处理登出"""
-        if messagebox.askyesno("确认", "确定要退出登录吗？"):
-            # 保存当前数据
-            self.save_data()
+    def handle_logout(self, confirm=True, keep_profile=True):
+        """处理登出
+
+        当前用户的云同步和同步线程留在ProfileCache中，再次登录该用户时直接复用。
+
+        Args:
+            confirm: 是否先询问用户（云端拒绝登录时直接登出）
+            keep_profile: 是否保留当前用户的状态（云端拒绝登录时关闭）
+        """
+        if not confirm or messagebox.askyesno("确认", "确定要退出登录吗？"):
+            # 停止计时并保存当前数据
+            if self.is_running:
+                self.toggle_timer()
+            else:
+                self.save_data()
             
-            # 关闭云同步
-            if hasattr(self, 'cloud_sync'):
-                self.cloud_sync.close()
-                delattr(self, 'cloud_sync')
+            # 同步线程上传最后的数据后按暂停状态调度
+            if hasattr(self, 'profile'):
+                if keep_profile:
+                    self.profile.deactivate()
+                else:
+                    self.profiles.discard(self.profile.username, timeout=self.SHUTDOWN_DEADLINE)
+            for name in ('profile', 'sync_worker', 'cloud_sync', 'history_log'):
+                if hasattr(self, name):
+                    delattr(self, name)
             
             # 登出用户
             self.user_manager.logout()
             
-            # 重置计时器
-            self.reset_timer()
-            
             # 关闭设置窗口（如果存在）
             for widget in self.root.winfo_children():
                 if isinstance(widget, tk.Toplevel):
@@ -2037,23 +2159,85 @@ class WorkTimer:
             # 显示登录窗口
             self.show_login_window()
 
+    def close_inactive_profiles(self):
+        """停止缓存中除当前用户外的同步线程"""
+        for profile in self.profiles.inactive(self.user_manager.get_current_user()):
+            try:
+                profile.close(timeout=self.SHUTDOWN_DEADLINE)
+            except Exception as e:
+                print(f"关闭用户状态失败: {e}")
+
     def manual_sync(self):
-        """手动同步数据"""
-        try:
-            data = self.cloud_sync.sync_data()
-            if data:
-                self.work_time_data = data
-                messagebox.showinfo("同步成功", "数据已同步")
-            else:
-                messagebox.showwarning("同步失败", "无法连接到云端，请检查网络连接")
-        except Exception as e:
-            messagebox.showerror("同步错误", f"同步过程中出现错误：{str(e)}")
+        """手动同步数据（在同步线程中执行，结果由process_sync_events显示）"""
+        if not hasattr(self, 'sync_worker'):
+            messagebox.showwarning("同步失败", "无法连接到云端，请检查网络连接")
+            return
+        self.sync_worker.request_sync()
+        
+    def process_sync_events(self):
+        """处理同步线程报告的事件（在UI线程中调用）"""
+        status_changed = False
+        while True:
+            try:
+                event = self.sync_events.get_nowait()
+            except queue.Empty:
+                break
+            # 缓存中其他用户的同步线程也会报告事件，只处理当前用户的
+            username = event.get('username')
+            if username is not None and username != self.user_manager.get_current_user():
+                continue
+            status_changed = True
+            
+            # 其他设备的改动已合并到本地文件，把今天新增的时长加到当前计时上
+            if event.get('added'):
+                self.adopt_remote_time(event)
+            
+            if event['event'] == 'manual_sync':
+                if event['ok'] and event['data']:
+                    messagebox.showinfo("同步成功", "数据已同步")
+                else:
+                    messagebox.showwarning("同步失败", "无法连接到云端，请检查网络连接")
+            elif event['event'] == 'upload' and not event['ok']:
+                print("上传数据到云端失败，已写入离线发件箱")
+                
+        # 后台复核登录的结果
+        while True:
+            try:
+                event = self.user_manager.events.get_nowait()
+            except queue.Empty:
+                break
+            if event['event'] == 'login_rejected' and event['username'] == self.user_manager.get_current_user():
+                messagebox.showwarning("需要重新登录", "该账户的密码已在其他设备上修改，请使用新密码重新登录")
+                self.handle_logout(confirm=False, keep_profile=False)
+                return
+                
+        if status_changed:
+            self.update_status_bar()
+
+    def adopt_remote_time(self, event):
+        """将同步合并的其他设备时长加到今天的累计时间上
+
+        上传时本设备的计数 = 本地总时长 - 其他设备的计数，
+        不加上其他设备的时长会少记本设备的工作时间。
+        加载数据之前写入的合并结果已在文件中，不再重复累加。
+        """
+        if event.get('merged_at') is None or event['merged_at'] <= getattr(self, 'data_loaded_at', 0):
+            return
+        added = event['added'].get(str(getattr(self, 'today', '')), 0)
+        if added <= 0:
+            return
+        self.accumulated_time += added
+        if not self.is_running and hasattr(self, 'time_label'):
+            self.refresh_timer_controls()
 
     def on_closing(self):
         """关闭程序时的处理"""
         self.save_data()  # 保存并同步数据
+        if hasattr(self, 'sync_worker'):
+            self.sync_worker.shutdown(timeout=self.SHUTDOWN_DEADLINE)
         if hasattr(self, 'cloud_sync'):
             self.cloud_sync.close()  # 关闭MongoDB连接
+        self.close_inactive_profiles()
         if hasattr(self, 'user_manager'):
             self.user_manager.close()  # 关闭用户管理器的MongoDB连接
         self.root.destroy()
@@ -2115,70 +2299,26 @@ class WorkTimer:
             # 即使不在运行状态，也更新显示，确保显示历史数据
             self.update_display()
         
+        # 跨天时立即同步
+        current_date = datetime.now().date()
+        if getattr(self, 'sync_date', current_date) != current_date and hasattr(self, 'sync_worker'):
+            self.sync_worker.notify_transition('rollover')
+        self.sync_date = current_date
+        
+        # 处理同步线程报告的状态
+        self.process_sync_events()
+        
         # 更新状态栏
         if hasattr(self, 'status_bar'):
             self.update_status_bar()
         
-        # 每60秒检查一次云同步状态
-        current_time = time.time()
-        if hasattr(self, 'last_cloud_check_time'):
-            if current_time - self.last_cloud_check_time >= 60:
-                self.check_cloud_connection()
-                self.last_cloud_check_time = current_time
-        else:
-            self.last_cloud_check_time = current_time
-        
         # 继续更新
         self.root.after(1000, self.update_timer)
     
-    def check_cloud_connection(self):
-        """检查云连接状态"""
-        connection_changed = False
-        
-        # 检查数据同步云连接
-        if hasattr(self, 'cloud_sync'):
-            # 如果云同步对象存在，尝试ping服务器
-            if hasattr(self.cloud_sync, 'client'):
-                try:
-                    # 尝试ping服务器
-                    if not self.cloud_sync.is_connected:
-                        self.cloud_sync.client.admin.command('ping')
-                        self.cloud_sync.is_connected = True
-                        print("MongoDB重新连接成功")
-                        connection_changed = True
-                except Exception as e:
-                    # 如果之前是连接状态，现在连接失败，更新状态
-                    if self.cloud_sync.is_connected:
-                        self.cloud_sync.is_connected = False
-                        print(f"MongoDB连接已断开: {e}")
-                        connection_changed = True
-                    else:
-                        print(f"MongoDB连接检查失败: {e}")
-        
-        # 检查用户管理器云连接
-        if hasattr(self, 'user_manager') and hasattr(self.user_manager, 'client'):
-            try:
-                # 尝试ping服务器
-                if not self.user_manager.is_connected:
-                    self.user_manager.client.admin.command('ping')
-                    self.user_manager.is_connected = True
-                    print("用户管理MongoDB重新连接成功")
-                    connection_changed = True
-                    
-                    # 连接恢复后，尝试同步用户数据
-                    self.user_manager.sync_users()
-            except Exception as e:
-                # 如果之前是连接状态，现在连接失败，更新状态
-                if self.user_manager.is_connected:
-                    self.user_manager.is_connected = False
-                    print(f"用户管理MongoDB连接已断开: {e}")
-                    connection_changed = True
-                else:
-                    print(f"用户管理MongoDB连接检查失败: {e}")
-        
-        # 如果连接状态有变化，更新状态栏
-        if connection_changed:
-            self.update_status_bar()
+    def on_connection_state(self, state):
+        """共享连接状态变化回调（可能在任意线程中调用），转交UI线程更新状态栏"""
+        self.sync_events.put({'event': 'connection', 'ok': state == ConnectionState.CONNECTED,
+                              'connected': state == ConnectionState.CONNECTED, 'data': None})
 
     def show_donate(self):
         """显示打赏二维码"""
@@ -2577,6 +2717,15 @@ class SoundManager:
             sound_thread.start()
 
 if __name__ == "__main__":
+    # 命令行子命令：pimer import <文件> --user <用户名>
+    if len(sys.argv) > 1 and sys.argv[1] == 'import':
+        from history_import import main as import_main
+        sys.exit(import_main(sys.argv[2:]))
+    # 命令行子命令：pimer restore --user <用户名> --at <时间>
+    if len(sys.argv) > 1 and sys.argv[1] == 'restore':
+        from history_log import main as restore_main
+        sys.exit(restore_main(sys.argv[2:]))
+        
     try:
         app = WorkTimer()
         app.run()